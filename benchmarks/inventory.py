@@ -0,0 +1,85 @@
+"""Item inventory engine benchmark
+
+Compares memory use, throughput and how long copying all counters
+(for snapshots and reconciliation) holds the inventory lock, for the
+dict-backed and array-backed item inventories on a large catalog.
+
+    pipenv run bench --items 2000000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from toypo.inventory import INVENTORY_ENGINES, ItemStorage
+
+
+def _fill(engine_name: str, n_items: int):
+    """Build an inventory with n_items, tracking allocated memory
+
+    Returns:
+        tuple[ExampleItemInventory, int]: Filled inventory and bytes allocated
+    """
+    gc.collect()
+    tracemalloc.start()
+    inventory = INVENTORY_ENGINES[engine_name]()
+    storage = ItemStorage(available=1_000_000, purchased=0,
+                          received=0, delivered=0)
+    for i in range(n_items):
+        inventory.add_item(f'sku{i}', storage)
+    allocated, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return inventory, allocated
+
+
+def _transact(inventory, n_items: int, n_ops: int) -> float:
+    """Run n_ops item moves spread over the catalog
+
+    Returns:
+        float: Operations per second
+    """
+    item_ids = [f'sku{(i * 7919) % n_items}' for i in range(n_ops)]
+    start = time.perf_counter()
+    for item_id in item_ids:
+        with inventory.transact_item_storage(item_id, 'available', 'purchased', 1):
+            pass
+        inventory.check_item(item_id)
+    return n_ops / (time.perf_counter() - start)
+
+
+def _dump(inventory) -> tuple[float, float]:
+    """Copy all counters out, like snapshots and reconciliation do
+
+    Returns:
+        tuple[float, float]: Seconds holding the lock, seconds after it
+    """
+    start = time.perf_counter()
+    with inventory.lock:
+        copied = inventory._copy_counters()  # pylint: disable=protected-access
+    locked = time.perf_counter()
+    inventory._dump_counters(copied)  # pylint: disable=protected-access
+    return locked - start, time.perf_counter() - locked
+
+
+def main():
+    """Run the benchmark for every inventory engine
+    """
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=200_000)
+    parser.add_argument('--ops', type=int, default=200_000)
+    args = parser.parse_args()
+
+    print(f'{"engine":<10}{"bytes/item":>12}{"total MiB":>12}{"ops/s":>12}'
+          f'{"dump locked s":>16}{"dump after s":>16}')
+    for engine_name in INVENTORY_ENGINES:
+        inventory, allocated = _fill(engine_name, args.items)
+        ops_per_sec = _transact(inventory, args.items, args.ops)
+        locked, after = _dump(inventory)
+        print(f'{engine_name:<10}{allocated / args.items:>12.1f}'
+              f'{allocated / 2**20:>12.1f}{ops_per_sec:>12.0f}'
+              f'{locked:>16.2f}{after:>16.2f}')
+        del inventory
+
+
+if __name__ == '__main__':
+    main()
@@ -1,38 +1,78 @@
+"""Test harness
+
+Every pytest worker (see pytest-xdist, `pytest -n auto`) gets
+its own shared-cache in-memory SQLite database. The schema is
+created once per worker, and every test runs inside a
+transaction on a single connection that is rolled back at the
+end of the test. Application commits only release a SAVEPOINT,
+so nothing a test writes is seen by the next one.
+"""
 import os
 
 import pytest
-
-from toypo.database import Base, SessionLocal
-from toypo.inventory import item_inventory
-from toypo.main import _auto_migrate
-
+from sqlalchemy import event
 
 SQL_ALCHEMY_URL = os.environ['SQL_ALCHEMY_URL']
 if 'test' not in SQL_ALCHEMY_URL:
     raise Exception(
         f"""SQL_ALCHEMY_URL does not contain "test", is this a test db url?
         It was {SQL_ALCHEMY_URL}""")
+# One database per xdist worker. This has to happen before toypo
+# is imported, since the engine is created from it at import time.
+os.environ['SQL_ALCHEMY_URL'] = SQL_ALCHEMY_URL.replace(
+    '{worker}', os.getenv('PYTEST_XDIST_WORKER', 'main'))
 
+# pylint: disable=wrong-import-position
+from toypo.crud import purchase_agreement_cache  # noqa: E402
+from toypo.database import SessionLocal, engine  # noqa: E402
+from toypo.inventory import item_inventory  # noqa: E402
+from toypo.main import _auto_migrate  # noqa: E402
+
+
+# pylint: disable=unused-argument
+@event.listens_for(engine, 'connect')
+def disable_pysqlite_transactions(dbapi_connection, connection_record):
+    """Let SQLAlchemy emit BEGIN itself
+
+    pysqlite's own transaction handling breaks SAVEPOINTs.
+    """
+    dbapi_connection.isolation_level = None
 
-@pytest.fixture(autouse=True)
-def clean_db():
-    """Clean DB between tests
 
-    Wipe out tables entirely
+@event.listens_for(engine, 'begin')
+def begin_transaction(conn):
+    """Emit BEGIN, since pysqlite won't anymore
+    """
+    conn.exec_driver_sql('BEGIN')
+
+
+@pytest.fixture(scope='session')
+def db_connection():
+    """Create the schema once, and hold the connection every test uses
+
+    Holding the connection also keeps the in-memory database alive.
     """
-    db = SessionLocal()
     _auto_migrate()
-    yield
-    Base.metadata.drop_all(db.connection().engine)
+    connection = engine.connect()
+    yield connection
+    connection.close()
+
 
+@pytest.fixture(autouse=True)
+def clean_db(db_connection):
+    """Roll back everything a test wrote to the DB
 
-@pytest.fixture(autouse=True, scope='session')
-def remove_db():
-    """Remove DB at end of session
+    Sessions join the test's transaction, and their commits
+    and rollbacks only go as far as a SAVEPOINT.
     """
-    db = SessionLocal()
+    transaction = db_connection.begin()
+    SessionLocal.configure(
+        bind=db_connection, join_transaction_mode='create_savepoint')
     yield
-    os.remove(db.connection().engine.url.translate_connect_args()['database'])
+    SessionLocal.configure(bind=engine, join_transaction_mode='conservative_savepoint')
+    transaction.rollback()
+    # PA IDs get reused once rolled back
+    purchase_agreement_cache.clear()
 
 
 @pytest.fixture(autouse=True)
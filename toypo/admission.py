@@ -0,0 +1,206 @@
+"""Admission Control
+
+ASGI middleware that rejects write requests early, before the body
+is read or parsed, so a single buyer flooding the API can't starve
+everyone else of worker threads, the SQLite writer and the item
+inventory lock.
+
+Two limits apply to write requests (POST, PUT, PATCH, DELETE):
+
+* A token bucket per known buyer, identified by the `X-Buyer-Id`
+  header. Only buyers on an allow-list get their own bucket, so
+  sending a new ID with every request doesn't get a fresh bucket.
+  Requests without a known buyer ID all share one, lower rate
+  bucket. The client address isn't used: behind a reverse proxy
+  it's the proxy's address for every tenant.
+* A cap on concurrent write requests across all buyers.
+
+Nothing here authenticates the header. It should be set (or
+stripped) by a gateway that knows who the buyer is, otherwise a
+client can spend a known buyer's bucket.
+
+Rejected requests get a 429 with a `Retry-After` header.
+"""
+import math
+import time
+from typing import Any, Collection, Optional
+
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from . import metrics
+
+WRITE_METHODS = frozenset(['POST', 'PUT', 'PATCH', 'DELETE'])
+BUYER_HEADER = b'x-buyer-id'
+
+
+class TokenBucket:
+    """Token bucket rate limiter
+
+    Holds up to `burst` tokens, refilled at `rate` tokens per second.
+    """
+
+    def __init__(self, rate: float, burst: float, now: float) -> None:
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = now
+
+    def take(self, now: float) -> float:
+        """Take a token if there is one
+
+        Args:
+            now (float): Current monotonic time
+
+        Returns:
+            float: 0 if a token was taken, otherwise seconds
+                until the next token is available
+        """
+        self.tokens = min(
+            self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0
+        return (1 - self.tokens) / self.rate
+
+
+class AdmissionControl:
+    """Per-buyer rate limiting and write concurrency cap middleware
+
+    All state is only touched from the event loop, so no locking
+    is needed.
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        rate: float,
+        burst: float,
+        max_concurrent_writes: int,
+        buyers: Collection[str] = (),
+        shared_rate: float = 0,
+        shared_burst: float = 0,
+        metrics_name: Optional[str] = 'admission',
+    ) -> None:
+        """Initialize the middleware
+
+        Args:
+            app (ASGIApp): Wrapped application
+            rate (float): Write requests per second per known buyer.
+                0 to disable.
+            burst (float): Write requests a known buyer can make at once
+            max_concurrent_writes (int): Write requests in flight across
+                all buyers. 0 to disable.
+            buyers (Collection[str], optional): Known buyer IDs, which
+                get their own bucket. Defaults to none.
+            shared_rate (float, optional): Write requests per second for all
+                requests without a known buyer ID together. 0 to disable.
+                Defaults to 0.
+            shared_burst (float, optional): Write requests those can make
+                at once. Defaults to 0.
+            metrics_name (Optional[str], optional): Name to register
+                metrics as, or None to not register them.
+                Defaults to 'admission'.
+        """
+        self.app = app
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrent_writes = max_concurrent_writes
+        self.buyers = frozenset(buyers)
+        self.shared_rate = shared_rate
+        self.shared_burst = shared_burst
+        self.buckets: dict[str, TokenBucket] = {}
+        self.shared_bucket: Optional[TokenBucket] = None
+        self.in_flight = 0
+        self.admitted = 0
+        self.rejected_rate_limited = 0
+        self.rejected_shared_rate_limited = 0
+        self.rejected_concurrency = 0
+        if metrics_name is not None:
+            metrics.register(metrics_name, self.stats)
+
+    def stats(self) -> dict[str, Any]:
+        """Admission counters, and writes currently in flight
+        """
+        return {
+            'queue_depth': self.in_flight,
+            'max_concurrent_writes': self.max_concurrent_writes,
+            'admitted': self.admitted,
+            'rejected_rate_limited': self.rejected_rate_limited,
+            'rejected_shared_rate_limited': self.rejected_shared_rate_limited,
+            'rejected_concurrency': self.rejected_concurrency,
+            'tracked_buyers': len(self.buckets),
+        }
+
+    def _buyer(self, scope: Scope) -> Optional[str]:
+        """Known buyer ID of a request, or None
+        """
+        for name, value in scope['headers']:
+            if name == BUYER_HEADER:
+                buyer = value.decode('latin-1')
+                return buyer if buyer in self.buyers else None
+        return None
+
+    def _retry_after(self, buyer: str) -> float:
+        """Take a token from a known buyer's bucket
+
+        Returns:
+            float: 0 if admitted, otherwise seconds to wait
+        """
+        now = time.monotonic()
+        bucket = self.buckets.get(buyer)
+        if bucket is None:
+            bucket = self.buckets[buyer] = TokenBucket(
+                self.rate, self.burst, now)
+        return bucket.take(now)
+
+    def _shared_retry_after(self) -> float:
+        """Take a token from the bucket shared by unknown buyers
+
+        Returns:
+            float: 0 if admitted, otherwise seconds to wait
+        """
+        now = time.monotonic()
+        if self.shared_bucket is None:
+            self.shared_bucket = TokenBucket(
+                self.shared_rate, self.shared_burst, now)
+        return self.shared_bucket.take(now)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http' or scope['method'] not in WRITE_METHODS:
+            await self.app(scope, receive, send)
+            return
+
+        buyer = self._buyer(scope)
+        if buyer is not None and self.rate > 0:
+            retry_after = self._retry_after(buyer)
+            if retry_after:
+                self.rejected_rate_limited += 1
+                await _reject(scope, receive, send, 'Rate limit exceeded', retry_after)
+                return
+        if buyer is None and self.shared_rate > 0:
+            retry_after = self._shared_retry_after()
+            if retry_after:
+                self.rejected_shared_rate_limited += 1
+                await _reject(scope, receive, send,
+                              'Rate limit for unknown buyers exceeded', retry_after)
+                return
+        if 0 < self.max_concurrent_writes <= self.in_flight:
+            self.rejected_concurrency += 1
+            await _reject(scope, receive, send, 'Too many concurrent writes', 1)
+            return
+
+        self.admitted += 1
+        self.in_flight += 1
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.in_flight -= 1
+
+
+async def _reject(scope: Scope, receive: Receive, send: Send, detail: str, retry_after: float):
+    response = JSONResponse(
+        {'detail': detail}, status_code=429,
+        headers={'Retry-After': str(math.ceil(retry_after))})
+    await response(scope, receive, send)
@@ -0,0 +1,58 @@
+"""PO Archiving
+
+Almost all traffic is for recent POs, so old POs that are done
+(RECEIVED or DELIVERED) are moved to archive tables. This keeps
+the purchase_orders table and its indexes small. Archived POs
+can still be read by ID, see crud.get_purchase_order.
+"""
+from datetime import datetime, timedelta, timezone
+from logging import getLogger
+
+from sqlalchemy.orm import Session
+
+from . import crud
+from .constants import ARCHIVE_AFTER_DAYS, ARCHIVE_CHUNK_SIZE
+from .database import SessionLocal
+from .models import PurchaseOrderStatus
+
+logger = getLogger(__name__)
+
+ARCHIVABLE_STATUSES = (PurchaseOrderStatus.RECEIVED,
+                       PurchaseOrderStatus.DELIVERED)
+
+
+def archive_purchase_orders(db: Session, created_before: datetime, chunk_size: int) -> int:
+    """Archive POs created before a given time, in chunks
+
+    Each chunk is its own transaction, so writers are only
+    blocked for one chunk at a time.
+
+    Args:
+        db (Session): database
+        created_before (datetime): Archive POs created before this (UTC)
+        chunk_size (int): POs to move per transaction
+
+    Returns:
+        int: Number of POs archived
+    """
+    archived = 0
+    while True:
+        purchase_order_ids = crud.get_archivable_purchase_order_ids(
+            db, ARCHIVABLE_STATUSES, created_before, chunk_size)
+        if not purchase_order_ids:
+            return archived
+        crud.archive_purchase_orders(db, purchase_order_ids)
+        archived += len(purchase_order_ids)
+
+
+def archive_old_purchase_orders():
+    """Archive POs older than ARCHIVE_AFTER_DAYS
+
+    Meant to be run periodically in the background.
+    """
+    created_before = datetime.now(timezone.utc).replace(tzinfo=None) \
+        - timedelta(days=ARCHIVE_AFTER_DAYS)
+    with SessionLocal() as db:
+        archived = archive_purchase_orders(
+            db, created_before, ARCHIVE_CHUNK_SIZE)
+    logger.info('Archived %s purchase orders', archived)
@@ -0,0 +1,45 @@
+"""Background Tasks
+
+Small helpers to run maintenance work (i.e. snapshots)
+periodically in a daemon thread, next to the web application.
+"""
+from logging import getLogger
+from threading import Event, Thread
+from typing import Callable
+
+logger = getLogger(__name__)
+
+
+class PeriodicTask(Thread):
+    """Run a function every `interval` seconds until stopped
+
+    Exceptions raised by the function are logged, and the
+    task keeps running on the next interval.
+    """
+
+    def __init__(self, name: str, interval: float, function: Callable[[], object]) -> None:
+        """Initialize the periodic task
+
+        Args:
+            name (str): Thread name, also used in logs
+            interval (float): Seconds to wait between runs
+            function (Callable[[], object]): Function to run
+        """
+        super().__init__(name=name, daemon=True)
+        self.interval = interval
+        self.function = function
+        self._stopped = Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.function()
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception('Periodic task %s failed', self.name)
+
+    def stop(self):
+        """Stop running the task, and wait for a current run to finish
+        """
+        self._stopped.set()
+        if self.is_alive():
+            self.join()
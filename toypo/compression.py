@@ -0,0 +1,149 @@
+"""Response Compression
+
+ASGI middleware that compresses responses with the best encoding
+the client accepts: zstd, brotli or gzip. zstd and brotli are only
+offered if the `zstandard` and `brotli` packages are installed.
+
+Small responses (under `min_size` bytes) aren't worth compressing
+and are sent as-is. Streamed responses are passed through too.
+"""
+import gzip
+from typing import Any, Callable, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from . import metrics
+
+try:
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+# Encoders by content-coding, most preferred first
+ENCODERS: dict[str, Callable[[bytes], bytes]] = {}
+if zstandard is not None:
+    ENCODERS['zstd'] = zstandard.ZstdCompressor(level=3).compress
+if brotli is not None:
+    ENCODERS['br'] = lambda body: brotli.compress(body, quality=4)
+ENCODERS['gzip'] = lambda body: gzip.compress(body, compresslevel=6)
+
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+
+def negotiate_encoding(accept_encoding: str) -> Optional[str]:
+    """Pick the encoding to use from an Accept-Encoding header
+
+    The highest q-value wins, ties go to our preference order.
+
+    Args:
+        accept_encoding (str): Accept-Encoding header value
+
+    Returns:
+        Optional[str]: Content-coding, or None to not compress
+    """
+    accepted: dict[str, float] = {}
+    for part in accept_encoding.lower().split(','):
+        coding, _, params = part.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip()] = quality
+
+    best, best_quality = None, 0.0
+    for coding in ENCODERS:
+        quality = accepted.get(coding, accepted.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+class CompressionMiddleware:
+    """Negotiated response compression middleware
+    """
+
+    def __init__(
+        self,
+        app: ASGIApp,
+        min_size: int = 1024,
+        metrics_name: Optional[str] = 'compression',
+    ) -> None:
+        """Initialize the middleware
+
+        Args:
+            app (ASGIApp): Wrapped application
+            min_size (int, optional): Smallest body to compress, in bytes.
+                Defaults to 1024.
+            metrics_name (Optional[str], optional): Name to register
+                metrics as, or None to not register them.
+                Defaults to 'compression'.
+        """
+        self.app = app
+        self.min_size = min_size
+        self.responses = {coding: 0 for coding in ENCODERS}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        if metrics_name is not None:
+            metrics.register(metrics_name, self.stats)
+
+    def stats(self) -> dict[str, Any]:
+        """Compressed responses per encoding, and bytes saved
+        """
+        return {
+            'responses': dict(self.responses),
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'bytes_saved': self.bytes_in - self.bytes_out,
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        coding = negotiate_encoding(
+            Headers(scope=scope).get('accept-encoding', ''))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message: Optional[Message] = None
+
+        async def send_compressed(message: Message):
+            nonlocal start_message
+            if message['type'] == 'http.response.start':
+                start_message = message
+                return
+            if start_message is None:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=start_message['headers'])
+            body = message.get('body', b'')
+            if message.get('more_body', False) or len(body) < self.min_size or \
+                    'content-encoding' in headers or \
+                    not headers.get('content-type', '').startswith(COMPRESSIBLE_TYPES):
+                await send(start_message)
+                start_message = None
+                await send(message)
+                return
+
+            compressed = ENCODERS[coding](body)
+            self.responses[coding] += 1
+            self.bytes_in += len(body)
+            self.bytes_out += len(compressed)
+            headers['Content-Encoding'] = coding
+            headers['Content-Length'] = str(len(compressed))
+            headers.add_vary_header('Accept-Encoding')
+            await send(start_message)
+            start_message = None
+            await send({'type': 'http.response.body', 'body': compressed})
+
+        await self.app(scope, receive, send_compressed)
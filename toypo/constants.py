@@ -10,3 +10,25 @@ load_dotenv()
 
 SQL_ALCHEMY_URL = os.environ['SQL_ALCHEMY_URL']
 AUTO_MIGRATE = os.getenv('AUTO_MIGRATE', 'False').lower() in ['true', '1']
+INVENTORY_STORAGE = os.getenv('INVENTORY_STORAGE', 'dict').lower()
+INVENTORY_SNAPSHOT_PATH = os.getenv('INVENTORY_SNAPSHOT_PATH') or None
+INVENTORY_SNAPSHOT_INTERVAL = float(
+    os.getenv('INVENTORY_SNAPSHOT_INTERVAL', '300'))
+ADMIN_TOKEN = os.getenv('ADMIN_TOKEN') or None
+ADMISSION_RATE = float(os.getenv('ADMISSION_RATE', '50'))
+ADMISSION_BURST = float(os.getenv('ADMISSION_BURST', '100'))
+ADMISSION_MAX_CONCURRENT_WRITES = int(
+    os.getenv('ADMISSION_MAX_CONCURRENT_WRITES', '16'))
+ADMISSION_BUYERS = frozenset(
+    buyer.strip() for buyer in os.getenv('ADMISSION_BUYERS', '').split(',')
+    if buyer.strip())
+ADMISSION_SHARED_RATE = float(os.getenv('ADMISSION_SHARED_RATE', '0'))
+ADMISSION_SHARED_BURST = float(os.getenv('ADMISSION_SHARED_BURST', '20'))
+PURCHASE_AGREEMENT_CACHE_SIZE = int(
+    os.getenv('PURCHASE_AGREEMENT_CACHE_SIZE', '1024'))
+ARCHIVE_AFTER_DAYS = float(os.getenv('ARCHIVE_AFTER_DAYS', '90'))
+ARCHIVE_INTERVAL = float(os.getenv('ARCHIVE_INTERVAL', '0'))
+ARCHIVE_CHUNK_SIZE = int(os.getenv('ARCHIVE_CHUNK_SIZE', '500'))
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+SINGLEFLIGHT_MAX_KEYS = int(os.getenv('SINGLEFLIGHT_MAX_KEYS', '1024'))
+SINGLEFLIGHT_TIMEOUT = float(os.getenv('SINGLEFLIGHT_TIMEOUT', '5'))
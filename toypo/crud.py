@@ -10,9 +10,154 @@ out to item inventory. Such an application operation
 is managed above the CRUD module -- this CRUD module
 would only handle the DB creating the PO in that example.
 """
-from sqlalchemy.orm import Session
+from collections import OrderedDict
+from collections.abc import Collection, Iterable
+from datetime import datetime
+from threading import Lock
+from typing import Any, NamedTuple, Optional
 
-from . import models, schemas
+from sqlalchemy import delete, func, insert, inspect, select, union_all, update
+from sqlalchemy.orm import Session, load_only, noload, selectinload
+
+from . import metrics, models, schemas
+from .constants import PURCHASE_AGREEMENT_CACHE_SIZE
+
+
+class PurchaseAgreementHeader(NamedTuple):
+    """PA fields that POs are validated against
+    """
+    seller_id: str
+    buyer_id: str
+    item_id: str
+
+
+class PurchaseAgreementCache:
+    """LRU cache of PA headers, by PA ID
+
+    PAs can't be updated, so cached headers never go stale.
+    Missing PAs are not cached, since they may be created later.
+    """
+
+    def __init__(self, max_size: int) -> None:
+        self.max_size = max_size
+        self._headers: OrderedDict[int, PurchaseAgreementHeader] = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, db: Session, purchase_agreement_id: int):
+        """Get a PA header, from the cache or the database
+
+        Args:
+            db (Session): database
+            purchase_agreement_id (int): PA ID
+
+        Returns:
+            PurchaseAgreementHeader | None: PA header if the PA exists
+        """
+        with self._lock:
+            header = self._headers.get(purchase_agreement_id)
+            if header is not None:
+                self._headers.move_to_end(purchase_agreement_id)
+                self.hits += 1
+                return header
+            self.misses += 1
+
+        row = db.query(
+            models.PurchaseAgreement.seller_id,
+            models.PurchaseAgreement.buyer_id,
+            models.PurchaseAgreement.item_id,
+        ).filter(models.PurchaseAgreement.id == purchase_agreement_id).first()
+        if row is None:
+            return None
+
+        header = PurchaseAgreementHeader(*row)
+        with self._lock:
+            self._headers[purchase_agreement_id] = header
+            if len(self._headers) > self.max_size:
+                self._headers.popitem(last=False)
+        return header
+
+    def clear(self):
+        """Forget every cached PA header, and reset stats
+        """
+        with self._lock:
+            self._headers.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self) -> dict[str, Any]:
+        """Cache hits, misses and size
+        """
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self._headers),
+            'max_size': self.max_size,
+        }
+
+
+purchase_agreement_cache = PurchaseAgreementCache(PURCHASE_AGREEMENT_CACHE_SIZE)
+metrics.register('purchase_agreement_cache', purchase_agreement_cache.stats)
+
+
+def _load_fields(model: type[models.Base], fields: Collection[str]):
+    """Query options to only load some fields of a model
+
+    Columns not in fields are not selected, and relationships
+    not in fields are not loaded at all.
+
+    Args:
+        model (type[models.Base]): SQLAlchemy model
+        fields (Collection[str]): Column and relationship names to load
+
+    Returns:
+        list: Query options
+    """
+    mapper = inspect(model)
+    columns = [getattr(model, column.key) for column in mapper.primary_key] + \
+        [getattr(model, field) for field in fields if field in mapper.columns]
+    options = [load_only(*columns)]
+    for relationship in mapper.relationships.keys():
+        attribute = getattr(model, relationship)
+        options.append(selectinload(attribute) if relationship in fields
+                       else noload(attribute))
+    return options
+
+
+def validate_purchase_agreement(
+    db: Session,
+    purchase_agreement_id: Optional[int],
+    seller_id: str,
+    buyer_id: str,
+    item_ids: Iterable[str],
+):
+    """Check that PO fields match its PA, if it has one
+
+    Meant to be called before claiming any inventory for the PO,
+    so mismatched POs never get to the write path.
+
+    Args:
+        db (Session): database
+        purchase_agreement_id (Optional[int]): PA ID of the PO
+        seller_id (str): PO seller
+        buyer_id (str): PO buyer
+        item_ids (Iterable[str]): Every item of the PO
+
+    Raises:
+        ValueError: If the PA does not exist or does not match
+    """
+    if purchase_agreement_id is None:
+        return
+    header = purchase_agreement_cache.get(db, purchase_agreement_id)
+    if header is None:
+        raise ValueError('Purchase Agreement not found')
+    for check_field, value in [('seller_id', seller_id), ('buyer_id', buyer_id)]:
+        if getattr(header, check_field) != value:
+            raise ValueError(
+                f'{check_field} must match one in the Purchase Agreement')
+    if any(item_id != header.item_id for item_id in item_ids):
+        raise ValueError('item_id must match one in the Purchase Agreement')
 
 
 def get_purchase_order(db: Session, purchase_order_id: int):
@@ -22,43 +167,158 @@ def get_purchase_order(db: Session, purchase_order_id: int):
         db (Session): database
         purchase_order_id (int): PO ID
 
+    Falls through to archived POs if the PO is not found.
+
     Returns:
-        models.PurchaseOrder | None: PO if it exists
+        models.PurchaseOrder | models.PurchaseOrderArchive | None: PO if it exists
     """
 
-    return db.query(models.PurchaseOrder).filter(
+    db_purchase_order = db.query(models.PurchaseOrder).filter(
         models.PurchaseOrder.id == purchase_order_id
     ).first()
+    if db_purchase_order is not None:
+        return db_purchase_order
+    return db.query(models.PurchaseOrderArchive).filter(
+        models.PurchaseOrderArchive.id == purchase_order_id
+    ).first()
 
 
-def get_purchase_orders(db: Session, skip: int = 0, limit: int = 100):
+def get_purchase_orders(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    fields: Optional[Collection[str]] = None
+):
     """Get several purchase orders
 
     Args:
         db (Session): database
         skip (int, optional): Start page at skip. Defaults to 0.
         limit (int, optional): Max list size. Defaults to 100.
+        fields (Optional[Collection[str]], optional): Only load these
+            fields. Defaults to None, for all fields.
 
     Returns:
         list[models.PurchaseOrder]: _description_
     """
 
-    return db.query(models.PurchaseOrder).offset(skip).limit(limit).all()
+    query = db.query(models.PurchaseOrder)
+    if fields is not None:
+        query = query.options(*_load_fields(models.PurchaseOrder, fields))
+    return query.offset(skip).limit(limit).all()
+
+
+def get_purchase_orders_by_ids(db: Session, purchase_order_ids: Collection[int]):
+    """Get the purchase orders with the given IDs
+
+    Args:
+        db (Session): database
+        purchase_order_ids (Collection[int]): PO IDs
+
+    Returns:
+        list[models.PurchaseOrder]: POs that exist, ordered by ID
+    """
+
+    return db.query(models.PurchaseOrder).filter(
+        models.PurchaseOrder.id.in_(purchase_order_ids)
+    ).order_by(models.PurchaseOrder.id).all()
+
+
+def get_item_quantities(db: Session, purchase_order_ids: Collection[int]):
+    """Get status and item quantities of several POs
+
+    Items come from the PO itself, or its line items for multi-line
+    POs. One query for all POs.
+
+    Args:
+        db (Session): database
+        purchase_order_ids (Collection[int]): PO IDs
+
+    Returns:
+        list[tuple[int, models.PurchaseOrderStatus, str, int]]: PO ID,
+            status, item_id and item_quantity. A PO with several lines
+            has several rows, and missing POs have none.
+    """
+
+    return db.execute(union_all(
+        select(
+            models.PurchaseOrder.id,
+            models.PurchaseOrder.status,
+            models.PurchaseOrder.item_id,
+            models.PurchaseOrder.item_quantity,
+        ).where(
+            models.PurchaseOrder.id.in_(purchase_order_ids),
+            models.PurchaseOrder.item_id.is_not(None),
+        ),
+        select(
+            models.PurchaseOrder.id,
+            models.PurchaseOrder.status,
+            models.PurchaseOrderLine.item_id,
+            models.PurchaseOrderLine.item_quantity,
+        ).join(models.PurchaseOrderLine.purchase_order).where(
+            models.PurchaseOrder.id.in_(purchase_order_ids),
+        ),
+    )).all()
+
+
+def get_item_quantity_totals(db: Session):
+    """Get total PO item quantities per item and PO status
+
+    One aggregate query over all POs, archived ones included.
+
+    Args:
+        db (Session): database
+
+    Returns:
+        list[tuple[str, models.PurchaseOrderStatus, int]]: item_id, status
+            and total item_quantity
+    """
+
+    quantities = union_all(
+        select(
+            models.PurchaseOrder.item_id,
+            models.PurchaseOrder.status,
+            models.PurchaseOrder.item_quantity,
+        ).where(models.PurchaseOrder.item_id.is_not(None)),
+        select(
+            models.PurchaseOrderLine.item_id,
+            models.PurchaseOrder.status,
+            models.PurchaseOrderLine.item_quantity,
+        ).join(models.PurchaseOrderLine.purchase_order),
+        select(
+            models.PurchaseOrderArchive.item_id,
+            models.PurchaseOrderArchive.status,
+            models.PurchaseOrderArchive.item_quantity,
+        ).where(models.PurchaseOrderArchive.item_id.is_not(None)),
+        select(
+            models.PurchaseOrderLineArchive.item_id,
+            models.PurchaseOrderArchive.status,
+            models.PurchaseOrderLineArchive.item_quantity,
+        ).join(
+            models.PurchaseOrderArchive,
+            models.PurchaseOrderLineArchive.purchase_order_id ==
+            models.PurchaseOrderArchive.id),
+    ).subquery()
+    return db.query(
+        quantities.c.item_id,
+        quantities.c.status,
+        func.sum(quantities.c.item_quantity),  # pylint: disable=not-callable
+    ).group_by(
+        quantities.c.item_id,
+        quantities.c.status,
+    ).all()
 
 
 def create_purchase_order(db: Session, purchase_order: schemas.PurchaseOrderCreate):
     """Create a PO
 
-    If the PO we want to create is associated with a PA, we
-    do validation from the PO <=> PA here.
+    If the PO we want to create is associated with a PA, it
+    should be checked with validate_purchase_agreement first.
 
     Args:
         db (Session): database
         purchase_order (schemas.PurchaseOrderCreate): New PO data
 
-    Raises:
-        ValueError: If PA does not match PO (only if there is a PA)
-
     Returns:
         models.PurchaseOrder: PO created from db
     """
@@ -67,15 +327,40 @@ def create_purchase_order(db: Session, purchase_order: schemas.PurchaseOrderCrea
         **vars(purchase_order)
     )
     db.add(db_purchase_order)
+    db.commit()
+    db.refresh(db_purchase_order)
+    return db_purchase_order
+
+
+def create_multi_line_purchase_order(
+    db: Session,
+    purchase_order: schemas.MultiLinePurchaseOrderCreate
+):
+    """Create a multi-line PO
+
+    All line items are inserted with a single executemany. If the PO
+    is associated with a PA, it should be checked with
+    validate_purchase_agreement first.
+
+    Args:
+        db (Session): database
+        purchase_order (schemas.MultiLinePurchaseOrderCreate): New PO data
 
+    Returns:
+        models.PurchaseOrder: PO created from db
+    """
+
+    db_purchase_order = models.PurchaseOrder(
+        **purchase_order.dict(exclude={'lines'})
+    )
+    db.add(db_purchase_order)
+    # Flush to get the PO ID for its lines
     db.flush()
 
-    if db_purchase_order.purchase_agreement is not None:
-        for check_field in ['seller_id', 'buyer_id', 'item_id']:
-            if getattr(db_purchase_order.purchase_agreement, check_field) != \
-                    getattr(purchase_order, check_field):
-                raise ValueError(
-                    f'{check_field} must match one in the Purchase Agreement')
+    db.execute(insert(models.PurchaseOrderLine), [
+        {'purchase_order_id': db_purchase_order.id, **line.dict()}
+        for line in purchase_order.lines
+    ])
 
     db.commit()
     db.refresh(db_purchase_order)
@@ -111,6 +396,116 @@ def update_purchase_order(db: Session, purchase_order: schemas.PurchaseOrderUpda
     return db_purchase_order
 
 
+def update_purchase_orders_status(
+    db: Session,
+    purchase_order_ids: Collection[int],
+    source_status: models.PurchaseOrderStatus,
+    target_status: models.PurchaseOrderStatus,
+):
+    """Move several POs from one status to another
+
+    A single conditional UPDATE. If any PO is not in source_status
+    anymore (i.e. it was changed concurrently), nothing is updated.
+
+    Args:
+        db (Session): database
+        purchase_order_ids (Collection[int]): PO IDs
+        source_status (models.PurchaseOrderStatus): Status all POs must be in
+        target_status (models.PurchaseOrderStatus): New status
+
+    Raises:
+        ValueError: If not every PO was in source_status
+    """
+
+    result = db.execute(
+        update(models.PurchaseOrder).where(
+            models.PurchaseOrder.id.in_(purchase_order_ids),
+            models.PurchaseOrder.status == source_status,
+        ).values(status=target_status).execution_options(
+            synchronize_session=False)
+    )
+    if result.rowcount != len(purchase_order_ids):  # type: ignore
+        db.rollback()
+        raise ValueError(
+            f'Purchase Orders are not all in {source_status} status anymore')
+    db.commit()
+
+
+def get_archivable_purchase_order_ids(
+    db: Session,
+    statuses: Collection[models.PurchaseOrderStatus],
+    created_before: datetime,
+    limit: int,
+):
+    """Get IDs of the oldest POs that can be archived
+
+    Args:
+        db (Session): database
+        statuses (Collection[models.PurchaseOrderStatus]): Statuses to archive
+        created_before (datetime): Only POs created before this (UTC)
+        limit (int): Max number of IDs
+
+    Returns:
+        list[int]: PO IDs, oldest first
+    """
+
+    return db.scalars(
+        select(models.PurchaseOrder.id).where(
+            models.PurchaseOrder.status.in_(statuses),
+            models.PurchaseOrder.created_at < created_before,
+        ).order_by(models.PurchaseOrder.id).limit(limit)
+    ).all()
+
+
+def get_archived_purchase_order_ids(db: Session, purchase_order_ids: Collection[int]):
+    """Get which of the given PO IDs are archived
+
+    Args:
+        db (Session): database
+        purchase_order_ids (Collection[int]): PO IDs
+
+    Returns:
+        list[int]: IDs of archived POs
+    """
+
+    return db.scalars(
+        select(models.PurchaseOrderArchive.id).where(
+            models.PurchaseOrderArchive.id.in_(purchase_order_ids))
+    ).all()
+
+
+def archive_purchase_orders(db: Session, purchase_order_ids: Collection[int]):
+    """Move POs and their line items to the archive tables
+
+    Copies and deletes happen in one transaction, with one
+    INSERT ... SELECT and one DELETE per table.
+
+    Args:
+        db (Session): database
+        purchase_order_ids (Collection[int]): PO IDs
+    """
+
+    po_columns = ['id', 'seller_id', 'buyer_id', 'item_id', 'item_quantity',
+                  'status', 'purchase_agreement_id', 'price_usd', 'created_at']
+    line_columns = ['id', 'purchase_order_id',
+                    'item_id', 'item_quantity', 'price_usd']
+    db.execute(insert(models.PurchaseOrderArchive).from_select(
+        po_columns,
+        select(*(getattr(models.PurchaseOrder, column) for column in po_columns)).where(
+            models.PurchaseOrder.id.in_(purchase_order_ids)),
+    ))
+    db.execute(insert(models.PurchaseOrderLineArchive).from_select(
+        line_columns,
+        select(*(getattr(models.PurchaseOrderLine, column) for column in line_columns)).where(
+            models.PurchaseOrderLine.purchase_order_id.in_(purchase_order_ids)),
+    ))
+    db.execute(delete(models.PurchaseOrderLine).where(
+        models.PurchaseOrderLine.purchase_order_id.in_(purchase_order_ids)))
+    db.execute(delete(models.PurchaseOrder).where(
+        models.PurchaseOrder.id.in_(purchase_order_ids)))
+    db.commit()
+
+
 def get_purchase_agreement(db: Session, purchase_agreement_id: int):
     """Get a PA
 
@@ -127,18 +522,28 @@ def get_purchase_agreement(db: Session, purchase_agreement_id: int):
     ).first()
 
 
-def get_purchase_agreements(db: Session, skip: int = 0, limit: int = 100):
+def get_purchase_agreements(
+    db: Session,
+    skip: int = 0,
+    limit: int = 100,
+    fields: Optional[Collection[str]] = None
+):
     """Get a list of PAs
 
     Args:
         db (Session): database
         skip (int, optional): Start at. Defaults to 0.
         limit (int, optional): Page size limit. Defaults to 100.
+        fields (Optional[Collection[str]], optional): Only load these
+            fields. Defaults to None, for all fields.
 
     Returns:
         list[models.PurchaseAgreement]: _description_
     """
-    return db.query(models.PurchaseAgreement).offset(skip).limit(limit).all()
+    query = db.query(models.PurchaseAgreement)
+    if fields is not None:
+        query = query.options(*_load_fields(models.PurchaseAgreement, fields))
+    return query.offset(skip).limit(limit).all()
 
 
 def create_purchase_agreement(db: Session, purchase_agreement: schemas.PurchaseAgreementCreate):
@@ -4,10 +4,22 @@ This isn't a real item inventory, but we create
 an example one. It has stubbed item data and
 handles item inventory operations.
 """
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import chain
+from logging import getLogger
+from operator import itemgetter
 from threading import Lock
-from typing import TypedDict
+from typing import Any, BinaryIO, Iterable, Optional, TypedDict
 from contextlib import contextmanager
 
+from .constants import INVENTORY_STORAGE
+
+logger = getLogger(__name__)
+
 
 class ItemStorage(TypedDict):
     """Tracked inventory for a single item
@@ -18,6 +30,22 @@ class ItemStorage(TypedDict):
     delivered: int
 
 
+STORAGE_KEYS = ('available', 'purchased', 'received', 'delivered')
+
+
+class MoveWatch:
+    """Items whose moves weren't settled at some point since a watch started
+
+    While an item is moved (see transact_item_storage), its counters
+    and the database disagree until the move finishes. Items that had a
+    move in progress when the watch started, or started one since, are
+    in `unsettled`.
+    """
+
+    def __init__(self, pending_item_ids: Iterable[str]) -> None:
+        self.unsettled: set[str] = set(pending_item_ids)
+
+
 class ItemNotFound(Exception):
     """Item not found
 
@@ -33,6 +61,34 @@ class NotEnoughItem(Exception):
     """
 
 
+EXAMPLE_ITEMS: dict[str, ItemStorage] = {
+    'item1': {
+        'available': 100,
+        'purchased': 0,
+        'received': 0,
+        'delivered': 0
+    },
+    'item2': {
+        'available': 100,
+        'purchased': 0,
+        'received': 0,
+        'delivered': 0
+    },
+    'item3': {
+        'available': 1,
+        'purchased': 0,
+        'received': 0,
+        'delivered': 0
+    },
+    'item4': {
+        'available': 0,
+        'purchased': 0,
+        'received': 0,
+        'delivered': 0
+    }
+}
+
+
 class ExampleItemInventory:
     """An example item inventory
 
@@ -42,6 +98,8 @@ class ExampleItemInventory:
     def __init__(self) -> None:
         """Initialize the inventory client
         """
+        self.pending_moves: dict[str, int] = {}
+        self._watches: list[MoveWatch] = []
         self._init_example_storage()
 
     def _init_example_storage(self):
@@ -49,33 +107,63 @@ class ExampleItemInventory:
 
         Fill it with mock data.
         """
-        self.items: dict[str, ItemStorage] = {
-            'item1': {
-                'available': 100,
-                'purchased': 0,
-                'received': 0,
-                'delivered': 0
-            },
-            'item2': {
-                'available': 100,
-                'purchased': 0,
-                'received': 0,
-                'delivered': 0
-            },
-            'item3': {
-                'available': 1,
-                'purchased': 0,
-                'received': 0,
-                'delivered': 0
-            },
-            'item4': {
-                'available': 0,
-                'purchased': 0,
-                'received': 0,
-                'delivered': 0
-            }
-        }
         self.lock = Lock()
+        self.journal: Optional[InventoryJournal] = None
+        self.items: dict[str, ItemStorage] = {}
+        for item_id, storage in EXAMPLE_ITEMS.items():
+            self.add_item(item_id, storage)
+
+    def add_item(self, item_id: str, storage: ItemStorage):
+        """Add an item to the inventory, or overwrite it if it exists
+
+        Args:
+            item_id (str): Item ID
+            storage (ItemStorage): Initial tracked inventory for the item
+        """
+        with self.lock:
+            self.items[item_id] = ItemStorage(**storage)
+            if self.journal is not None:
+                self.journal.record_set(item_id, storage)
+
+    def _copy_counters(self) -> Any:
+        """Copy out all item IDs and their counters, as quickly as possible
+
+        The caller should hold the lock. Pass the copy to _dump_counters
+        after releasing it.
+        """
+        return list(self.items), list(map(
+            itemgetter(*STORAGE_KEYS), self.items.values()))
+
+    @staticmethod
+    def _dump_counters(copied: Any) -> tuple[list[str], dict[str, array]]:
+        """Item IDs and one array of counters per storage key, from a copy
+
+        Args:
+            copied (Any): Copy made by _copy_counters
+        """
+        item_ids, rows = copied
+        interleaved = array('q', chain.from_iterable(rows))
+        return item_ids, {
+            storage_key: interleaved[offset::len(STORAGE_KEYS)]
+            for offset, storage_key in enumerate(STORAGE_KEYS)
+        }
+
+    def _load_counters(self, item_ids: list[str], counters: dict[str, array]):
+        """Replace the whole inventory with the given items and counters
+
+        Args:
+            item_ids (list[str]): Item IDs, in the same order as the counters
+            counters (dict[str, array]): One array of counters per storage key
+        """
+        self.items = {  # pylint: disable=attribute-defined-outside-init
+            item_id: ItemStorage(
+                available=counters['available'][index],
+                purchased=counters['purchased'][index],
+                received=counters['received'][index],
+                delivered=counters['delivered'][index],
+            )
+            for index, item_id in enumerate(item_ids)
+        }
 
     def _sub_quantity(self, item_id: str, storage_key: str, quantity: int):
         """Subtract quantity from an item storage key
@@ -99,6 +187,8 @@ class ExampleItemInventory:
             if new_quantity < 0:
                 raise NotEnoughItem(f"Not enough '{item_id}' in {storage_key}")
             item[storage_key] = new_quantity
+            if self.journal is not None:
+                self.journal.record_add(item_id, storage_key, -quantity)
         return item
 
     def _add_quantity(self, item_id: str, storage_key: str, quantity: int):
@@ -117,8 +207,126 @@ class ExampleItemInventory:
             raise ItemNotFound(f"Item '{item_id}' was not found")
         with self.lock:
             item[storage_key] += quantity
+            if self.journal is not None:
+                self.journal.record_add(item_id, storage_key, quantity)
         return item
 
+    def _sub_quantities(self, quantities: dict[str, int], storage_key: str):
+        """Subtract quantities of several items from a storage key, atomically
+
+        Either every item is subtracted, or none are.
+
+        Args:
+            quantities (dict[str, int]): Quantity to subtract, per item ID
+            storage_key (str): Where to subtract from (i.e. 'purchased', 'received')
+
+        Raises:
+            ItemNotFound: If any item does not exist in inventory
+            NotEnoughItem: If there is not enough of any item in the
+                inventory class to subtract.
+        """
+        items = [(item_id, self.check_item(item_id), quantity)
+                 for item_id, quantity in quantities.items()]
+        with self.lock:
+            for item_id, item, quantity in items:
+                if item[storage_key] - quantity < 0:
+                    raise NotEnoughItem(f"Not enough '{item_id}' in {storage_key}")
+            for item_id, item, quantity in items:
+                item[storage_key] -= quantity
+                if self.journal is not None:
+                    self.journal.record_add(item_id, storage_key, -quantity)
+
+    def _add_quantities(self, quantities: dict[str, int], storage_key: str):
+        """Add quantities of several items to a storage key, atomically
+
+        Args:
+            quantities (dict[str, int]): Quantity to add, per item ID
+            storage_key (str): Where to add it to (i.e. 'purchased', 'received')
+
+        Raises:
+            ItemNotFound: If any item does not exist in inventory
+        """
+        items = [(item_id, self.check_item(item_id), quantity)
+                 for item_id, quantity in quantities.items()]
+        with self.lock:
+            for item_id, item, quantity in items:
+                item[storage_key] += quantity
+                if self.journal is not None:
+                    self.journal.record_add(item_id, storage_key, quantity)
+
+    def _change_quantities(
+        self,
+        item_id: str,
+        changes: dict[str, int],
+        watch: Optional[MoveWatch] = None,
+    ) -> bool:
+        """Add quantities to several storage keys of an item, atomically
+
+        Negative quantities are subtracted. Either every change is
+        made, or none are.
+
+        Args:
+            item_id (str): Item ID
+            changes (dict[str, int]): Quantity to add, per storage key
+            watch (Optional[MoveWatch], optional): If given, nothing is
+                changed for items it saw unsettled. Defaults to None.
+
+        Raises:
+            ItemNotFound: If item does not exist in inventory
+            NotEnoughItem: If any storage key would go below zero
+
+        Returns:
+            bool: False if nothing was changed because of the watch
+        """
+        item = self.check_item(item_id)
+        with self.lock:
+            if watch is not None and item_id in watch.unsettled:
+                return False
+            for storage_key, quantity in changes.items():
+                if item[storage_key] + quantity < 0:
+                    raise NotEnoughItem(f"Not enough '{item_id}' in {storage_key}")
+            for storage_key, quantity in changes.items():
+                item[storage_key] += quantity
+                if self.journal is not None:
+                    self.journal.record_add(item_id, storage_key, quantity)
+        return True
+
+    @contextmanager
+    def _watch_moves(self):
+        """Watch for items with moves in progress, see MoveWatch
+
+        Yields:
+            MoveWatch: Watch, updated until the with block exits
+        """
+        with self.lock:
+            watch = MoveWatch(self.pending_moves)
+            self._watches.append(watch)
+        try:
+            yield watch
+        finally:
+            with self.lock:
+                self._watches.remove(watch)
+
+    def _begin_moves(self, item_ids: Iterable[str]):
+        """Mark items as having a move in progress
+        """
+        with self.lock:
+            for item_id in item_ids:
+                self.pending_moves[item_id] = self.pending_moves.get(item_id, 0) + 1
+                for watch in self._watches:
+                    watch.unsettled.add(item_id)
+
+    def _end_moves(self, item_ids: Iterable[str]):
+        """Mark items' moves begun with _begin_moves as done
+        """
+        with self.lock:
+            for item_id in item_ids:
+                pending = self.pending_moves[item_id] - 1
+                if pending:
+                    self.pending_moves[item_id] = pending
+                else:
+                    del self.pending_moves[item_id]
+
     def check_item(self, item_id: str):
         """Check if item exists
 
@@ -147,6 +355,9 @@ class ExampleItemInventory:
         exception happens while we're yielding, we try to
         move the quantity back to the source_storage_key.
 
+        The item has a move in progress (see MoveWatch) until the
+        transaction is done.
+
         @TODO There may be a failure mode where a database record is
         created while this function is yielding, but an exception
         is still raised. In such a case the inventory may not be
@@ -166,13 +377,546 @@ class ExampleItemInventory:
             Exception: Any exception thrown while yielding will be reraised,
             after a cleanup operation.
         """
-        self._sub_quantity(item_id, source_storage_key, quantity)
+        self._begin_moves([item_id])
+        try:
+            self._sub_quantity(item_id, source_storage_key, quantity)
+            try:
+                yield
+            except Exception as e:
+                self._add_quantity(item_id, source_storage_key, quantity)
+                raise e
+            self._add_quantity(item_id, target_storage_key, quantity)
+        finally:
+            self._end_moves([item_id])
+
+    @contextmanager
+    def transact_items_storage(
+        self,
+        quantities: dict[str, int],
+        source_storage_key: str,
+        target_storage_key: str,
+    ):
+        """transact_item_storage for several items at once
+
+        All items are moved out of source_storage_key in one atomic
+        operation before yielding, so either all of them are claimed
+        or none are. See transact_item_storage for the failure modes.
+
+        Args:
+            quantities (dict[str, int]): Quantity to move over, per item ID
+            source_storage_key (str): Where to move tracked inventory from
+            target_storage_key (str): Where to move tracked inventory to
+
+        Raises:
+            Exception: Any exception thrown while yielding will be reraised,
+            after a cleanup operation.
+        """
+        self._begin_moves(quantities)
         try:
-            yield
-        except Exception as e:
-            self._add_quantity(item_id, source_storage_key, quantity)
-            raise e
-        self._add_quantity(item_id, target_storage_key, quantity)
+            self._sub_quantities(quantities, source_storage_key)
+            try:
+                yield
+            except Exception as e:
+                self._add_quantities(quantities, source_storage_key)
+                raise e
+            self._add_quantities(quantities, target_storage_key)
+        finally:
+            self._end_moves(quantities)
+
+
+class CompactItemInventory(ExampleItemInventory):
+    """An example item inventory backed by typed arrays
+
+    Same operations as ExampleItemInventory, but item IDs are interned
+    to dense integer indexes and every storage key is kept in its own
+    contiguous array of 64-bit counters. This saves a dict per item,
+    which adds up for catalogs with millions of items.
+
+    check_item returns a copy of the item storage rather than a live
+    view into the inventory.
+    """
 
+    def _init_example_storage(self):
+        """Initialize the example inventory client
 
-item_inventory = ExampleItemInventory()
+        Fill it with mock data.
+        """
+        self.lock = Lock()
+        self.journal: Optional[InventoryJournal] = None
+        self.item_indexes: dict[str, int] = {}
+        self.counters: dict[str, array] = {
+            storage_key: array('q') for storage_key in STORAGE_KEYS
+        }
+        for item_id, storage in EXAMPLE_ITEMS.items():
+            self.add_item(item_id, storage)
+
+    def add_item(self, item_id: str, storage: ItemStorage):
+        """Add an item to the inventory, or overwrite it if it exists
+
+        Args:
+            item_id (str): Item ID
+            storage (ItemStorage): Initial tracked inventory for the item
+        """
+        with self.lock:
+            index = self.item_indexes.get(item_id)
+            if index is None:
+                self.item_indexes[item_id] = len(self.item_indexes)
+                for storage_key in STORAGE_KEYS:
+                    self.counters[storage_key].append(storage[storage_key])
+            else:
+                for storage_key in STORAGE_KEYS:
+                    self.counters[storage_key][index] = storage[storage_key]
+            if self.journal is not None:
+                self.journal.record_set(item_id, storage)
+
+    def _copy_counters(self) -> Any:
+        """Copy out all item IDs and their counters, as quickly as possible
+
+        The caller should hold the lock. Pass the copy to _dump_counters
+        after releasing it.
+        """
+        return list(self.item_indexes), {
+            storage_key: array('q', counter)
+            for storage_key, counter in self.counters.items()
+        }
+
+    @staticmethod
+    def _dump_counters(copied: Any) -> tuple[list[str], dict[str, array]]:
+        """Item IDs and one array of counters per storage key, from a copy
+
+        Args:
+            copied (Any): Copy made by _copy_counters
+        """
+        return copied
+
+    def _load_counters(self, item_ids: list[str], counters: dict[str, array]):
+        """Replace the whole inventory with the given items and counters
+
+        Args:
+            item_ids (list[str]): Item IDs, in the same order as the counters
+            counters (dict[str, array]): One array of counters per storage key
+        """
+        self.item_indexes = {  # pylint: disable=attribute-defined-outside-init
+            item_id: index for index, item_id in enumerate(item_ids)}
+        self.counters = dict(counters)  # pylint: disable=attribute-defined-outside-init
+
+    def _index(self, item_id: str) -> int:
+        """Get the dense index of an item
+
+        Args:
+            item_id (str): Item ID
+
+        Raises:
+            ItemNotFound: If item does not exist in inventory
+        """
+        index = self.item_indexes.get(item_id)
+        if index is None:
+            raise ItemNotFound(f"Item '{item_id}' was not found")
+        return index
+
+    def _storage(self, index: int) -> ItemStorage:
+        """Copy the counters of an item out into an ItemStorage
+
+        Args:
+            index (int): Dense item index
+        """
+        return ItemStorage(
+            available=self.counters['available'][index],
+            purchased=self.counters['purchased'][index],
+            received=self.counters['received'][index],
+            delivered=self.counters['delivered'][index],
+        )
+
+    def _sub_quantity(self, item_id: str, storage_key: str, quantity: int):
+        """Subtract quantity from an item storage key
+
+        Args:
+            item_id (str): Item ID
+            storage_key (str): Where to subtract from (i.e. 'purchased', 'received')
+            quantity (int): Quantity to subtract
+
+        Raises:
+            ItemNotFound: If item does not exist in inventory
+            NotEnoughItem: If there is not enough items in the inventory class
+                to subtract.
+        """
+        index = self._index(item_id)
+        counter = self.counters[storage_key]
+        with self.lock:
+            new_quantity = counter[index] - quantity
+            if new_quantity < 0:
+                raise NotEnoughItem(f"Not enough '{item_id}' in {storage_key}")
+            counter[index] = new_quantity
+            if self.journal is not None:
+                self.journal.record_add(item_id, storage_key, -quantity)
+            return self._storage(index)
+
+    def _add_quantity(self, item_id: str, storage_key: str, quantity: int):
+        """Add quantity to an item storage key
+
+        Args:
+            item_id (str): Item ID
+            storage_key (str): Where to add it to (i.e. 'purchased', 'received')
+            quantity (int): Quantity to add
+
+        Raises:
+            ItemNotFound: If item does not exist in inventory
+        """
+        index = self._index(item_id)
+        with self.lock:
+            self.counters[storage_key][index] += quantity
+            if self.journal is not None:
+                self.journal.record_add(item_id, storage_key, quantity)
+            return self._storage(index)
+
+    def _sub_quantities(self, quantities: dict[str, int], storage_key: str):
+        """Subtract quantities of several items from a storage key, atomically
+
+        Either every item is subtracted, or none are.
+
+        Args:
+            quantities (dict[str, int]): Quantity to subtract, per item ID
+            storage_key (str): Where to subtract from (i.e. 'purchased', 'received')
+
+        Raises:
+            ItemNotFound: If any item does not exist in inventory
+            NotEnoughItem: If there is not enough of any item in the
+                inventory class to subtract.
+        """
+        indexes = [(item_id, self._index(item_id), quantity)
+                   for item_id, quantity in quantities.items()]
+        counter = self.counters[storage_key]
+        with self.lock:
+            for item_id, index, quantity in indexes:
+                if counter[index] - quantity < 0:
+                    raise NotEnoughItem(f"Not enough '{item_id}' in {storage_key}")
+            for item_id, index, quantity in indexes:
+                counter[index] -= quantity
+                if self.journal is not None:
+                    self.journal.record_add(item_id, storage_key, -quantity)
+
+    def _add_quantities(self, quantities: dict[str, int], storage_key: str):
+        """Add quantities of several items to a storage key, atomically
+
+        Args:
+            quantities (dict[str, int]): Quantity to add, per item ID
+            storage_key (str): Where to add it to (i.e. 'purchased', 'received')
+
+        Raises:
+            ItemNotFound: If any item does not exist in inventory
+        """
+        indexes = [(item_id, self._index(item_id), quantity)
+                   for item_id, quantity in quantities.items()]
+        counter = self.counters[storage_key]
+        with self.lock:
+            for item_id, index, quantity in indexes:
+                counter[index] += quantity
+                if self.journal is not None:
+                    self.journal.record_add(item_id, storage_key, quantity)
+
+    def _change_quantities(
+        self,
+        item_id: str,
+        changes: dict[str, int],
+        watch: Optional[MoveWatch] = None,
+    ) -> bool:
+        """Add quantities to several storage keys of an item, atomically
+
+        Negative quantities are subtracted. Either every change is
+        made, or none are.
+
+        Args:
+            item_id (str): Item ID
+            changes (dict[str, int]): Quantity to add, per storage key
+            watch (Optional[MoveWatch], optional): If given, nothing is
+                changed for items it saw unsettled. Defaults to None.
+
+        Raises:
+            ItemNotFound: If item does not exist in inventory
+            NotEnoughItem: If any storage key would go below zero
+
+        Returns:
+            bool: False if nothing was changed because of the watch
+        """
+        index = self._index(item_id)
+        with self.lock:
+            if watch is not None and item_id in watch.unsettled:
+                return False
+            for storage_key, quantity in changes.items():
+                if self.counters[storage_key][index] + quantity < 0:
+                    raise NotEnoughItem(f"Not enough '{item_id}' in {storage_key}")
+            for storage_key, quantity in changes.items():
+                self.counters[storage_key][index] += quantity
+                if self.journal is not None:
+                    self.journal.record_add(item_id, storage_key, quantity)
+        return True
+
+    def check_item(self, item_id: str):
+        """Check if item exists
+
+        Args:
+            item_id (str): Item ID
+
+        Raises:
+            ItemNotFound: Item does not exist in inventory
+        """
+        return self._storage(self._index(item_id))
+
+
+class SnapshotError(Exception):
+    """Snapshot or move log could not be read
+
+    Should be raised if a snapshot file is not one we wrote,
+    or was written by an incompatible version.
+    """
+
+
+class InventoryJournal:
+    """Snapshots and an append-only move log for an item inventory
+
+    A snapshot is a binary file with every item ID and its counters.
+    Every inventory change made after a snapshot is appended to a move
+    log, so restoring is loading the last snapshot and replaying the
+    move logs that follow it.
+
+    Move logs are numbered by generation. A snapshot of generation N
+    holds the inventory as it was when move log N was started, so it
+    can be written outside of the inventory lock while moves keep
+    landing in log N. Logs older than the last snapshot are removed.
+
+    Snapshot layout (little-endian):
+        header: magic, version, generation, item count, item ID blob size
+        item IDs: utf-8, NUL separated, padded to 8 bytes
+        counters: one int64 array per storage key, in STORAGE_KEYS order
+    """
+    SNAPSHOT_MAGIC = b'TOYPOINV'
+    LOG_MAGIC = b'TOYPOLOG'
+    VERSION = 1
+
+    _SNAPSHOT_HEADER = struct.Struct('<8sIQQQ')
+    _LOG_HEADER = struct.Struct('<8sI')
+    _RECORD_HEADER = struct.Struct('<BH')
+    _ADD_RECORD = struct.Struct('<Bq')
+    _SET_RECORD = struct.Struct(f'<{len(STORAGE_KEYS)}q')
+    _OP_ADD = 0
+    _OP_SET = 1
+
+    def __init__(self, inventory: ExampleItemInventory, path: str) -> None:
+        """Initialize the journal
+
+        Nothing is read or written until restore is called.
+
+        Args:
+            inventory (ExampleItemInventory): Inventory to journal
+            path (str): Snapshot file path. Move logs are kept next
+                to it, as `<path>.<generation>.log`.
+        """
+        self.inventory = inventory
+        self.path = path
+        self.generation = 0
+        self._log: Optional[BinaryIO] = None
+
+    def _log_path(self, generation: int) -> str:
+        return f'{self.path}.{generation}.log'
+
+    def restore(self):
+        """Load the last snapshot and replay the move logs after it
+
+        Afterwards the journal is attached to the inventory, and
+        new moves are appended to the latest move log. If there is
+        no snapshot, move logs are replayed on top of the current
+        inventory contents.
+
+        Raises:
+            SnapshotError: If the snapshot or a move log can't be read
+        """
+        if os.path.exists(self.path):
+            self.generation = self._read_snapshot()
+        while os.path.exists(self._log_path(self.generation)):
+            log_path = self._log_path(self.generation)
+            end = self._replay(log_path)
+            # Cut off a torn record, so new records don't land after it
+            if end < os.path.getsize(log_path):
+                os.truncate(log_path, end)
+            if not os.path.exists(self._log_path(self.generation + 1)):
+                break
+            self.generation += 1
+        self._log = self._open_log(self.generation)
+        self.inventory.journal = self
+
+    def snapshot(self):
+        """Write a new snapshot and start a new move log
+
+        Only copying counters and switching the move log happens
+        while holding the inventory lock. The copy is turned into
+        arrays and written to a temporary file after releasing it,
+        and the file is then moved into place.
+        """
+        with self.inventory.lock:
+            copied = self.inventory._copy_counters()  # pylint: disable=protected-access
+            generation = self.generation + 1
+            new_log = self._open_log(generation)
+            if self._log is not None:
+                self._log.close()
+            self._log = new_log
+            self.generation = generation
+
+        item_ids, counters = self.inventory._dump_counters(copied)  # pylint: disable=protected-access
+        self._write_snapshot(generation, item_ids, counters)
+        for old_generation in range(generation - 1, -1, -1):
+            if not os.path.exists(self._log_path(old_generation)):
+                break
+            os.remove(self._log_path(old_generation))
+        logger.info('Inventory snapshot %s written with %s items',
+                    generation, len(item_ids))
+
+    def close(self):
+        """Detach from the inventory and close the move log
+        """
+        with self.inventory.lock:
+            if self.inventory.journal is self:
+                self.inventory.journal = None
+            if self._log is not None:
+                self._log.close()
+                self._log = None
+
+    def record_add(self, item_id: str, storage_key: str, quantity: int):
+        """Append a quantity change to the move log
+
+        The caller should hold the inventory lock.
+        """
+        self._write_record(self._OP_ADD, item_id, self._ADD_RECORD.pack(
+            STORAGE_KEYS.index(storage_key), quantity))
+
+    def record_set(self, item_id: str, storage: ItemStorage):
+        """Append an added or overwritten item to the move log
+
+        The caller should hold the inventory lock.
+        """
+        self._write_record(self._OP_SET, item_id, self._SET_RECORD.pack(
+            *(storage[storage_key] for storage_key in STORAGE_KEYS)))
+
+    def _write_record(self, opcode: int, item_id: str, payload: bytes):
+        if self._log is None:
+            return
+        encoded_id = item_id.encode()
+        self._log.write(self._RECORD_HEADER.pack(opcode, len(encoded_id))
+                        + encoded_id + payload)
+
+    def _open_log(self, generation: int) -> BinaryIO:
+        """Open a move log for appending, writing its header if it is new
+        """
+        log = open(self._log_path(generation), 'ab',  # pylint: disable=consider-using-with
+                   buffering=0)
+        if log.tell() == 0:
+            log.write(self._LOG_HEADER.pack(self.LOG_MAGIC, self.VERSION))
+        return log
+
+    def _replay(self, log_path: str) -> int:
+        """Apply every complete record of a move log to the inventory
+
+        A truncated record at the end of the log (i.e. a crash while
+        writing it) is ignored.
+
+        Returns:
+            int: Log size up to the end of the last complete record
+        """
+        with open(log_path, 'rb') as log:
+            data = log.read()
+        if len(data) < self._LOG_HEADER.size:
+            return 0
+        magic, version = self._LOG_HEADER.unpack_from(data)
+        if magic != self.LOG_MAGIC or version != self.VERSION:
+            raise SnapshotError(f'{log_path} is not a version '
+                                f'{self.VERSION} inventory move log')
+
+        offset = self._LOG_HEADER.size
+        replayed = 0
+        while offset + self._RECORD_HEADER.size <= len(data):
+            opcode, id_size = self._RECORD_HEADER.unpack_from(data, offset)
+            id_start = offset + self._RECORD_HEADER.size
+            payload_start = id_start + id_size
+            record = self._ADD_RECORD if opcode == self._OP_ADD else self._SET_RECORD
+            if payload_start + record.size > len(data):
+                logger.warning('Ignoring truncated record in %s', log_path)
+                break
+            item_id = data[id_start:payload_start].decode()
+            values = record.unpack_from(data, payload_start)
+            if opcode == self._OP_ADD:
+                self.inventory._add_quantity(  # pylint: disable=protected-access
+                    item_id, STORAGE_KEYS[values[0]], values[1])
+            else:
+                self.inventory.add_item(
+                    item_id, ItemStorage(**dict(zip(STORAGE_KEYS, values))))
+            offset = payload_start + record.size
+            replayed += 1
+        logger.info('Replayed %s inventory moves from %s', replayed, log_path)
+        return offset
+
+    def _write_snapshot(self, generation: int, item_ids: list[str],
+                        counters: dict[str, array]):
+        ids_blob = '\0'.join(item_ids).encode()
+        padding = -(self._SNAPSHOT_HEADER.size + len(ids_blob)) % 8
+        tmp_path = f'{self.path}.tmp'
+        with open(tmp_path, 'wb') as snapshot_file:
+            snapshot_file.write(self._SNAPSHOT_HEADER.pack(
+                self.SNAPSHOT_MAGIC, self.VERSION, generation,
+                len(item_ids), len(ids_blob)))
+            snapshot_file.write(ids_blob + b'\0' * padding)
+            for storage_key in STORAGE_KEYS:
+                counter = counters[storage_key]
+                if sys.byteorder == 'big':
+                    counter.byteswap()
+                counter.tofile(snapshot_file)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _read_snapshot(self) -> int:
+        """Memory-map the snapshot file and load it into the inventory
+
+        Returns:
+            int: Snapshot generation
+        """
+        with open(self.path, 'rb') as snapshot_file, \
+                mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            if len(mapped) < self._SNAPSHOT_HEADER.size:
+                raise SnapshotError(f'{self.path} is not an inventory snapshot')
+            magic, version, generation, item_count, ids_size = \
+                self._SNAPSHOT_HEADER.unpack_from(mapped)
+            if magic != self.SNAPSHOT_MAGIC or version != self.VERSION:
+                raise SnapshotError(f'{self.path} is not a version '
+                                    f'{self.VERSION} inventory snapshot')
+
+            ids_start = self._SNAPSHOT_HEADER.size
+            offset = ids_start + ids_size + \
+                (-(ids_start + ids_size) % 8)
+            expected_size = offset + 8 * item_count * len(STORAGE_KEYS)
+            if len(mapped) != expected_size:
+                raise SnapshotError(f'{self.path} is truncated')
+
+            item_ids = mapped[ids_start:ids_start + ids_size].decode().split('\0') \
+                if item_count else []
+            counters: dict[str, array] = {}
+            with memoryview(mapped) as view:
+                for storage_key in STORAGE_KEYS:
+                    counter = array('q')
+                    counter.frombytes(view[offset:offset + 8 * item_count])
+                    if sys.byteorder == 'big':
+                        counter.byteswap()
+                    counters[storage_key] = counter
+                    offset += 8 * item_count
+
+        with self.inventory.lock:
+            self.inventory._load_counters(item_ids, counters)  # pylint: disable=protected-access
+        logger.info('Restored inventory snapshot %s with %s items',
+                    generation, item_count)
+        return generation
+
+
+INVENTORY_ENGINES: dict[str, type[ExampleItemInventory]] = {
+    'dict': ExampleItemInventory,
+    'compact': CompactItemInventory,
+}
+
+item_inventory = INVENTORY_ENGINES[INVENTORY_STORAGE]()
@@ -3,18 +3,59 @@ Main FastAPI application
 
 Go to /docs to see auto-generated openapi documentation!
 """
+import math
+import secrets
 from logging import getLogger
+from typing import Callable, Collection, Hashable, Optional
 
-from fastapi import Depends, FastAPI, HTTPException, Query
+from fastapi import Depends, FastAPI, Header, HTTPException, Query
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, PlainTextResponse, Response
+from fastapi.routing import APIRoute
+from pydantic import BaseModel  # pylint: disable=no-name-in-module
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import IntegrityError
 
-from . import constants, crud, inventory, models, schemas
+from . import (archive, constants, crud, inventory, metrics, models, reconcile,
+               schemas, transitions)
+from .admission import AdmissionControl
+from .background import PeriodicTask
+from .compression import CompressionMiddleware
+from .profiler import ProfilerBusy, profiler
+from .singleflight import SingleFlight, SingleFlightTimeout
 from .database import SessionLocal, engine
 
 logger = getLogger(__name__)
 
 app = FastAPI()
+app.add_middleware(
+    CompressionMiddleware,
+    min_size=constants.COMPRESSION_MIN_SIZE,
+)
+# Added last so it runs first, and rejects requests early
+app.add_middleware(
+    AdmissionControl,
+    rate=constants.ADMISSION_RATE,
+    burst=constants.ADMISSION_BURST,
+    max_concurrent_writes=constants.ADMISSION_MAX_CONCURRENT_WRITES,
+    buyers=constants.ADMISSION_BUYERS,
+    shared_rate=constants.ADMISSION_SHARED_RATE,
+    shared_burst=constants.ADMISSION_SHARED_BURST,
+)
+
+# Set up by the startup hooks
+# pylint: disable=invalid-name
+inventory_journal: Optional[inventory.InventoryJournal] = None
+inventory_snapshots: Optional[PeriodicTask] = None
+purchase_order_archiving: Optional[PeriodicTask] = None
+# pylint: enable=invalid-name
+
+# Concurrent identical reads share one query and one serialized response
+read_flight = SingleFlight(
+    max_keys=constants.SINGLEFLIGHT_MAX_KEYS,
+    timeout=constants.SINGLEFLIGHT_TIMEOUT,
+    metrics_name='singleflight',
+)
 
 
 def get_db():
@@ -49,6 +90,16 @@ def get_item_inventory():
         raise HTTPException(400, detail=str(bad_input)) from bad_input
 
 
+def require_admin(x_admin_token: Optional[str] = Header(None)):
+    """Only allow requests with the admin token
+
+    Admin routes are disabled entirely if no ADMIN_TOKEN is set.
+    """
+    if constants.ADMIN_TOKEN is None or x_admin_token is None or \
+            not secrets.compare_digest(x_admin_token, constants.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail='Admin token required')
+
+
 def _auto_migrate():
     """Run auto-migrations
 
@@ -62,16 +113,174 @@ def _auto_migrate():
     models.Base.metadata.create_all(bind=engine)
 
 
+@app.on_event('startup')
+def restore_inventory():
+    """Warm boot the item inventory from its last snapshot
+
+    Only if INVENTORY_SNAPSHOT_PATH is set. Snapshots are then
+    taken every INVENTORY_SNAPSHOT_INTERVAL seconds, and every
+    inventory move in between goes to the move log.
+    """
+    global inventory_journal, inventory_snapshots  # pylint: disable=global-statement
+    if constants.INVENTORY_SNAPSHOT_PATH is None:
+        return
+    inventory_journal = inventory.InventoryJournal(
+        inventory.item_inventory, constants.INVENTORY_SNAPSHOT_PATH)
+    inventory_journal.restore()
+    inventory_snapshots = PeriodicTask(
+        'inventory-snapshots', constants.INVENTORY_SNAPSHOT_INTERVAL,
+        inventory_journal.snapshot)
+    inventory_snapshots.start()
+
+
+@app.on_event('shutdown')
+def snapshot_inventory():
+    """Take a last inventory snapshot on shutdown
+    """
+    global inventory_journal, inventory_snapshots  # pylint: disable=global-statement
+    if inventory_snapshots is not None:
+        inventory_snapshots.stop()
+        inventory_snapshots = None
+    if inventory_journal is not None:
+        inventory_journal.snapshot()
+        inventory_journal.close()
+        inventory_journal = None
+
+
+@app.on_event('startup')
+def start_archiving():
+    """Archive old POs every ARCHIVE_INTERVAL seconds
+
+    Only if ARCHIVE_INTERVAL is set.
+    """
+    global purchase_order_archiving  # pylint: disable=global-statement
+    if constants.ARCHIVE_INTERVAL <= 0:
+        return
+    purchase_order_archiving = PeriodicTask(
+        'purchase-order-archiving', constants.ARCHIVE_INTERVAL,
+        archive.archive_old_purchase_orders)
+    purchase_order_archiving.start()
+
+
+@app.on_event('shutdown')
+def stop_archiving():
+    """Stop archiving old POs
+    """
+    global purchase_order_archiving  # pylint: disable=global-statement
+    if purchase_order_archiving is not None:
+        purchase_order_archiving.stop()
+        purchase_order_archiving = None
+
+
+def _transition_purchase_orders(
+    db: Session,
+    item_inventory: inventory.ExampleItemInventory,
+    purchase_order_ids: list[int],
+    target_status: models.PurchaseOrderStatus,
+):
+    """Run a PO status transition, raising HTTPExceptions on failure
+    """
+    try:
+        return transitions.transition_purchase_orders(
+            db, item_inventory, purchase_order_ids, target_status)
+    except transitions.PurchaseOrderNotFound as not_found:
+        raise HTTPException(status_code=404, detail=str(not_found)) from not_found
+    except transitions.InvalidTransition as invalid:
+        raise HTTPException(status_code=400, detail=str(invalid)) from invalid
+    finally:
+        # Some POs may be updated even if others failed
+        _forget_reads(purchase_order_ids)
+
+
+def _parse_fields(fields: Optional[str], model: type[BaseModel]):
+    """Parse a `fields=` sparse fieldset query parameter
+
+    Args:
+        fields (Optional[str]): Comma separated field names, or None
+        model (type[BaseModel]): Response model the fields are from
+
+    Raises:
+        HTTPException: If any field is not in the response model
+
+    Returns:
+        frozenset[str] | None: Field names, None for all fields
+    """
+    if fields is None:
+        return None
+    field_set = frozenset(
+        field.strip() for field in fields.split(',') if field.strip())
+    unknown = field_set - model.__fields__.keys()
+    if not field_set or unknown:
+        raise HTTPException(
+            status_code=400,
+            detail=f'Unknown fields: {", ".join(sorted(unknown))}' if unknown
+            else 'No fields requested')
+    return field_set
+
+
+def _response_model(model: type[BaseModel], fields: Optional[frozenset[str]]):
+    """Response model for a sparse fieldset, or the full model
+    """
+    return model if fields is None else schemas.sparse_model(model, fields)
+
+
+def _render_json(content) -> bytes:
+    """Serialize a response body the same way FastAPI does
+    """
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def _json_response(body: bytes):
+    """Response from an already serialized JSON body
+    """
+    return Response(content=body, media_type='application/json')
+
+
+def _coalesced_read(key: Hashable, read: Callable[[], Optional[bytes]]):
+    """Run a read route through single-flight, raising HTTPExceptions on failure
+    """
+    try:
+        return read_flight.do(key, read)
+    except SingleFlightTimeout as timeout:
+        raise HTTPException(
+            status_code=503, detail=str(timeout),
+            headers={'Retry-After': str(math.ceil(read_flight.timeout))}) from timeout
+
+
+def _forget_reads(purchase_order_ids: Collection[int] = ()):
+    """End reads in flight that a committed write may have made stale
+
+    So a read sent after a write returned doesn't get a result
+    from before it. Reads of other single POs are kept.
+    """
+    purchase_order_ids = set(purchase_order_ids)
+    read_flight.forget(
+        lambda key: key[0] != 'purchase_order' or key[1] in purchase_order_ids)
+
+
+FIELDS_DESCRIPTION = 'Comma separated fields to return, i.e. `id,status`. All fields by default.'
+
+
 @app.get('/purchase_orders/', response_model=list[schemas.PurchaseOrder])
 def read_purchase_orders(
     skip: int = Query(0, description='Skip to start page at'),
     limit: int = Query(100, description='Limit size per page'),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     db: Session = Depends(get_db)
 ):
     """Read several POs
     """
-    purchase_orders = crud.get_purchase_orders(db, skip=skip, limit=limit)
-    return purchase_orders
+    field_set = _parse_fields(fields, schemas.PurchaseOrder)
+    model = _response_model(schemas.PurchaseOrder, field_set)
+
+    def read():
+        return _render_json([
+            model.from_orm(db_purchase_order)
+            for db_purchase_order in crud.get_purchase_orders(
+                db, skip=skip, limit=limit, fields=field_set)
+        ])
+    return _json_response(
+        _coalesced_read(('purchase_orders', skip, limit, field_set), read))
 
 
 @app.get('/purchase_orders/{purchase_order_id}', response_model=schemas.PurchaseOrder)
@@ -81,11 +290,16 @@ def read_purchase_order(
 ):
     """Read a single PO
     """
-    db_purchase_order = crud.get_purchase_order(
-        db, purchase_order_id=purchase_order_id)
-    if db_purchase_order is None:
+    def read():
+        db_purchase_order = crud.get_purchase_order(
+            db, purchase_order_id=purchase_order_id)
+        if db_purchase_order is None:
+            return None
+        return _render_json(schemas.PurchaseOrder.from_orm(db_purchase_order))
+    body = _coalesced_read(('purchase_order', purchase_order_id), read)
+    if body is None:
         raise HTTPException(status_code=404, detail='Purchase Order not found')
-    return db_purchase_order
+    return _json_response(body)
 
 
 @app.post('/purchase_orders/receive/{purchase_order_id}', response_model=schemas.PurchaseOrder)
@@ -100,32 +314,58 @@ def receive_purchase_order(
     This will mark the PO from 'purchased' to 'received',
     and move tracked inventory items from purchased  to received as well.
     """
-    purchase_order_update = schemas.PurchaseOrderUpdate(
-        id=purchase_order_id,
-        status=models.PurchaseOrderStatus.RECEIVED,
-    )
-    db_purchase_order = crud.get_purchase_order(
-        db, purchase_order_id=purchase_order_id)
-    if db_purchase_order is None:
-        raise HTTPException(status_code=404, detail='Purchase Order not found')
+    return _transition_purchase_orders(
+        db, item_inventory, [purchase_order_id],
+        models.PurchaseOrderStatus.RECEIVED)[0]
+
+
+@app.post('/purchase_orders/receive', response_model=list[schemas.PurchaseOrder])
+def receive_purchase_orders(
+    purchase_orders: schemas.PurchaseOrderTransition,
+    db: Session = Depends(get_db),
+    item_inventory: inventory.ExampleItemInventory = Depends(
+        get_item_inventory)
+):
+    """Receive several POs
+
+    Either every PO is received, or none are.
+    """
+    return _transition_purchase_orders(
+        db, item_inventory, purchase_orders.purchase_order_ids,
+        models.PurchaseOrderStatus.RECEIVED)
 
-    if db_purchase_order.status != models.PurchaseOrderStatus.PURCHASED:
-        raise HTTPException(
-            status_code=400, detail='Can only receive a PO from purchased status')
-
-    item_id: str = db_purchase_order.item_id  # type: ignore
-    item_quantity: int = db_purchase_order.item_quantity  # type: ignore
-    # This inventory operations "claims" items from 'purchased' before
-    # dropping them in received.
-    # If a failure happens, item inventory will try to reset the
-    # inventory back to 'purchased' state.
-    #
-    # See transact_item_storage class for more details
-    with item_inventory.transact_item_storage(item_id, 'purchased', 'received', item_quantity):
-        crud.update_purchase_order(
-            db, purchase_order=purchase_order_update)
-    db.flush()
-    return db_purchase_order
+
+@app.post('/purchase_orders/deliver/{purchase_order_id}', response_model=schemas.PurchaseOrder)
+def deliver_purchase_order(
+    purchase_order_id: int,
+    db: Session = Depends(get_db),
+    item_inventory: inventory.ExampleItemInventory = Depends(
+        get_item_inventory)
+):
+    """Deliver a PO
+
+    This will mark the PO from 'received' to 'delivered',
+    and move tracked inventory items from received to delivered as well.
+    """
+    return _transition_purchase_orders(
+        db, item_inventory, [purchase_order_id],
+        models.PurchaseOrderStatus.DELIVERED)[0]
+
+
+@app.post('/purchase_orders/deliver', response_model=list[schemas.PurchaseOrder])
+def deliver_purchase_orders(
+    purchase_orders: schemas.PurchaseOrderTransition,
+    db: Session = Depends(get_db),
+    item_inventory: inventory.ExampleItemInventory = Depends(
+        get_item_inventory)
+):
+    """Deliver several POs
+
+    Either every PO is delivered, or none are.
+    """
+    return _transition_purchase_orders(
+        db, item_inventory, purchase_orders.purchase_order_ids,
+        models.PurchaseOrderStatus.DELIVERED)
 
 
 @app.post('/purchase_orders/', response_model=schemas.PurchaseOrder)
@@ -140,11 +380,41 @@ def create_purchase_order(
     Will reduce inventory for that item, if creation can be
     made successfully.
     """
+    crud.validate_purchase_agreement(
+        db, purchase_order.purchase_agreement_id, purchase_order.seller_id,
+        purchase_order.buyer_id, [purchase_order.item_id])
     with item_inventory.transact_item_storage(
             purchase_order.item_id, 'available',
             'purchased', purchase_order.item_quantity):
         db_purchase_order = crud.create_purchase_order(
             db=db, purchase_order=purchase_order)
+    _forget_reads([db_purchase_order.id])
+    return db_purchase_order
+
+
+@app.post('/purchase_orders/multi_line', response_model=schemas.PurchaseOrder)
+def create_multi_line_purchase_order(
+    purchase_order: schemas.MultiLinePurchaseOrderCreate,
+    db: Session = Depends(get_db),
+    item_inventory: inventory.ExampleItemInventory = Depends(
+        get_item_inventory)
+):
+    """Create a PO with several line items
+
+    Inventory for all items is reserved at once, so
+    either every line can be reserved or none are.
+    """
+    crud.validate_purchase_agreement(
+        db, purchase_order.purchase_agreement_id, purchase_order.seller_id,
+        purchase_order.buyer_id, [line.item_id for line in purchase_order.lines])
+    quantities: dict[str, int] = {}
+    for line in purchase_order.lines:
+        quantities[line.item_id] = quantities.get(
+            line.item_id, 0) + line.item_quantity
+    with item_inventory.transact_items_storage(quantities, 'available', 'purchased'):
+        db_purchase_order = crud.create_multi_line_purchase_order(
+            db=db, purchase_order=purchase_order)
+    _forget_reads([db_purchase_order.id])
     return db_purchase_order
 
 
@@ -155,25 +425,39 @@ def read_purchase_agreement(
 ):
     """Read a single PA
     """
-    db_purchase_agreement = crud.get_purchase_agreement(
-        db, purchase_agreement_id=purchase_agreement_id)
-    if db_purchase_agreement is None:
+    def read():
+        db_purchase_agreement = crud.get_purchase_agreement(
+            db, purchase_agreement_id=purchase_agreement_id)
+        if db_purchase_agreement is None:
+            return None
+        return _render_json(schemas.PurchaseAgreement.from_orm(db_purchase_agreement))
+    body = _coalesced_read(('purchase_agreement', purchase_agreement_id), read)
+    if body is None:
         raise HTTPException(
             status_code=404, detail='Purchase Agreement not found')
-    return db_purchase_agreement
+    return _json_response(body)
 
 
 @app.get('/purchase_agreements/', response_model=list[schemas.PurchaseAgreement])
 def read_purchase_agreements(
     skip: int = Query(0, description='Skip to start page at'),
     limit: int = Query(100, description='Limit size per page'),
+    fields: Optional[str] = Query(None, description=FIELDS_DESCRIPTION),
     db: Session = Depends(get_db)
 ):
     """Read several purchase agreements
     """
-    purchase_agreements = crud.get_purchase_agreements(
-        db, skip=skip, limit=limit)
-    return purchase_agreements
+    field_set = _parse_fields(fields, schemas.PurchaseAgreement)
+    model = _response_model(schemas.PurchaseAgreement, field_set)
+
+    def read():
+        return _render_json([
+            model.from_orm(db_purchase_agreement)
+            for db_purchase_agreement in crud.get_purchase_agreements(
+                db, skip=skip, limit=limit, fields=field_set)
+        ])
+    return _json_response(
+        _coalesced_read(('purchase_agreements', skip, limit, field_set), read))
 
 
 @app.post('/purchase_agreements/', response_model=schemas.PurchaseAgreement)
@@ -192,7 +476,60 @@ def create_purchase_agreement(
         PA created in DB
     """
     item_inventory.check_item(purchase_agreement.item_id)
-    return crud.create_purchase_agreement(db=db, purchase_agreement=purchase_agreement)
+    db_purchase_agreement = crud.create_purchase_agreement(
+        db=db, purchase_agreement=purchase_agreement)
+    _forget_reads()
+    return db_purchase_agreement
+
+
+@app.post('/admin/inventory/reconcile', response_model=schemas.InventoryReconciliation,
+          dependencies=[Depends(require_admin)])
+def reconcile_inventory(
+    fix: bool = Query(False, description='Fix drifted items in the inventory'),
+    db: Session = Depends(get_db),
+    item_inventory: inventory.ExampleItemInventory = Depends(
+        get_item_inventory)
+):
+    """Reconcile item inventory against POs
+
+    Reports items whose purchased/received/delivered counters don't
+    match the POs in the database, and fixes them if asked to.
+    """
+    return reconcile.reconcile_inventory(db, item_inventory, fix=fix)
+
+
+@app.get('/admin/metrics', dependencies=[Depends(require_admin)])
+def read_metrics():
+    """Read in-process metrics
+
+    i.e. admission control counters
+    """
+    return metrics.collect()
+
+
+@app.post('/admin/profile', response_class=PlainTextResponse,
+          dependencies=[Depends(require_admin)])
+def profile(
+    seconds: float = Query(10, gt=0, le=60, description='How long to profile for'),
+    interval_ms: float = Query(
+        10, ge=1, le=1000, description='Milliseconds between samples'),
+):
+    """Profile the worker for a few seconds
+
+    Samples the stacks of every thread in this worker, and returns
+    them as collapsed stacks (flamegraph.pl / speedscope input).
+    Route handlers show as `route:<name>`, CRUD functions as
+    `crud:<function>` and waits on the inventory lock as
+    `inventory:lock_wait`.
+    """
+    route_names = {
+        route.endpoint.__code__: route.name
+        for route in app.routes if isinstance(route, APIRoute)
+    }
+    try:
+        return profiler.profile(seconds, interval_ms / 1000, route_names)
+    except ProfilerBusy as busy:
+        raise HTTPException(status_code=409, detail=str(busy)) from busy
 
 
 if constants.AUTO_MIGRATE:
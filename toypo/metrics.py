@@ -0,0 +1,25 @@
+"""Metrics
+
+A tiny registry of in-process metrics. Components (i.e. middleware,
+caches) register a function returning their current counters, and
+all of them are collected together for the admin metrics route.
+"""
+from typing import Any, Callable
+
+_sources: dict[str, Callable[[], dict[str, Any]]] = {}
+
+
+def register(name: str, source: Callable[[], dict[str, Any]]):
+    """Register a metrics source, replacing any other with the same name
+
+    Args:
+        name (str): Metrics group name
+        source (Callable[[], dict[str, Any]]): Returns the current metrics
+    """
+    _sources[name] = source
+
+
+def collect() -> dict[str, dict[str, Any]]:
+    """Collect metrics from every registered source
+    """
+    return {name: source() for name, source in _sources.items()}
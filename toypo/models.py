@@ -23,13 +23,14 @@ class PurchaseOrderStatus(enum.StrEnum):
 class PurchaseOrder(Base):
     """PO (Purchase Order)
 
-    As of right now, a PO directly contains order information.
-    It also only allows for one kind of item, so that wouldn't
-    adequately represent orders.
-
-    We keep PO 1-1 to items just for simplicity's sake right now.
+    A PO either directly contains order information for one kind
+    of item (item_id and item_quantity), or has several line items
+    in `lines` and leaves item_id and item_quantity empty.
     """
     __tablename__ = 'purchase_orders'
+    # IDs must never be reused once the newest PO is archived,
+    # see archive.py
+    __table_args__ = {'sqlite_autoincrement': True}
 
     id = Column(Integer, primary_key=True, index=True)
     seller_id = Column(String, index=True, comment='Seller User ID, external')
@@ -50,6 +51,30 @@ class PurchaseOrder(Base):
 
     purchase_agreement = relationship(
         'PurchaseAgreement', back_populates='purchase_orders')
+    # Loaded with one extra `IN` query for all POs of a query
+    lines = relationship(
+        'PurchaseOrderLine', back_populates='purchase_order',
+        lazy='selectin', order_by='PurchaseOrderLine.id')
+
+
+class PurchaseOrderLine(Base):
+    """PO line item
+
+    One kind of item, with its quantity and price, in a multi-line PO.
+    """
+    __tablename__ = 'purchase_order_lines'
+    __table_args__ = {'sqlite_autoincrement': True}
+
+    id = Column(Integer, primary_key=True, index=True)
+    purchase_order_id = Column(
+        Integer, ForeignKey('purchase_orders.id'), index=True,
+        nullable=False, comment='PO this line belongs to')
+    item_id = Column(String, index=True, comment='Item ID')
+    item_quantity = Column(Integer, comment='Number of items')
+    price_usd = Column(
+        Float, comment='Price of the line in USD as floating point number')
+
+    purchase_order = relationship('PurchaseOrder', back_populates='lines')
 
 
 class PurchaseAgreement(Base):
@@ -77,3 +102,47 @@ class PurchaseAgreement(Base):
 
     purchase_orders = relationship(
         'PurchaseOrder', back_populates='purchase_agreement')
+
+
+class PurchaseOrderArchive(Base):
+    """Archived PO
+
+    Old RECEIVED/DELIVERED POs are moved here (see archive.py) to keep
+    the purchase_orders table and its indexes small. Same columns as
+    PurchaseOrder and the same ID, but only indexed by ID.
+    """
+    __tablename__ = 'purchase_orders_archive'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    seller_id = Column(String, comment='Seller User ID, external')
+    buyer_id = Column(String, comment='Buyer User ID, external')
+    item_id = Column(String, comment='Item ID')
+    item_quantity = Column(Integer, comment='Number of items')
+    status = Column(Enum(PurchaseOrderStatus), comment='Status of the PO.')
+    purchase_agreement_id = Column(
+        Integer, nullable=True, comment='Associated purchase agreement, if it exists.')
+    price_usd = Column(
+        Float, comment='Price in USD as floating point number')
+    created_at = Column(DateTime(timezone=True))
+    archived_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    lines = relationship(
+        'PurchaseOrderLineArchive', lazy='selectin',
+        order_by='PurchaseOrderLineArchive.id')
+
+
+class PurchaseOrderLineArchive(Base):
+    """Archived PO line item
+
+    Line items of archived POs, see PurchaseOrderArchive.
+    """
+    __tablename__ = 'purchase_order_lines_archive'
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    purchase_order_id = Column(
+        Integer, ForeignKey('purchase_orders_archive.id'), index=True,
+        nullable=False, comment='Archived PO this line belongs to')
+    item_id = Column(String, comment='Item ID')
+    item_quantity = Column(Integer, comment='Number of items')
+    price_usd = Column(
+        Float, comment='Price of the line in USD as floating point number')
@@ -0,0 +1,141 @@
+"""Sampling Profiler
+
+An on-demand sampling profiler for production debugging. While
+profiling, the stacks of every other thread are sampled at a fixed
+interval, and counted as collapsed stacks, the format flamegraph
+tools (i.e. flamegraph.pl, speedscope) read:
+
+    thread;outer_frame;...;inner_frame count
+
+Frames are labelled so they are easy to find:
+
+* `route:<name>` for FastAPI route handlers
+* `crud:<function>` for CRUD functions
+* `inventory:lock_wait` for threads waiting on the item inventory lock
+
+Nothing is hooked into the interpreter, so there is no
+overhead unless a profile is running.
+"""
+import linecache
+import sys
+import threading
+import time
+from collections import Counter
+from types import CodeType, FrameType
+from typing import Optional
+
+INVENTORY_MODULE = 'toypo.inventory'
+CRUD_MODULE = 'toypo.crud'
+
+
+class ProfilerBusy(Exception):
+    """Profiler busy
+
+    Should be raised if a profile is requested while
+    another one is still running.
+    """
+
+
+class SamplingProfiler:
+    """Samples the stacks of all threads for a while
+    """
+
+    def __init__(self) -> None:
+        self._running = threading.Lock()
+        self._lock_wait_lines: dict[tuple[str, int], bool] = {}
+
+    def profile(
+        self,
+        seconds: float,
+        interval: float,
+        route_names: Optional[dict[CodeType, str]] = None,
+    ) -> str:
+        """Sample all other threads, and return collapsed stacks
+
+        Blocks the calling thread for `seconds`.
+
+        Args:
+            seconds (float): How long to profile for
+            interval (float): Seconds between samples
+            route_names (Optional[dict[CodeType, str]], optional): Route
+                names by the code object of their handler. Defaults to None.
+
+        Raises:
+            ProfilerBusy: If another profile is running
+
+        Returns:
+            str: Collapsed stacks, one per line, most samples first
+        """
+        if not self._running.acquire(blocking=False):
+            raise ProfilerBusy('A profile is already running')
+        try:
+            stacks = self._sample(seconds, interval, route_names or {})
+        finally:
+            self._running.release()
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
+
+    def _sample(
+        self,
+        seconds: float,
+        interval: float,
+        route_names: dict[CodeType, str],
+    ) -> Counter:
+        own_thread = threading.get_ident()
+        stacks: Counter = Counter()
+        thread_names: dict[int, str] = {}
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            frames = sys._current_frames()  # pylint: disable=protected-access
+            if frames.keys() - thread_names.keys():
+                thread_names = {thread.ident: thread.name  # type: ignore
+                                for thread in threading.enumerate()}
+            for thread_id, frame in frames.items():
+                if thread_id != own_thread:
+                    stacks[self._collapse(
+                        frame, thread_names.get(thread_id, str(thread_id)),
+                        route_names)] += 1
+            del frames
+            time.sleep(interval)
+        return stacks
+
+    def _collapse(self, frame: Optional[FrameType], thread_name: str,
+                  route_names: dict[CodeType, str]) -> str:
+        """Collapse a thread's stack into one line, outermost frame first
+        """
+        labels = []
+        if frame is not None and self._is_lock_wait(frame):
+            labels.append('inventory:lock_wait')
+        while frame is not None:
+            labels.append(_frame_label(frame, route_names))
+            frame = frame.f_back
+        labels.append(thread_name.replace(';', ':'))
+        return ';'.join(reversed(labels))
+
+    def _is_lock_wait(self, frame: FrameType) -> bool:
+        """Whether the innermost frame is acquiring the inventory lock
+
+        Acquiring a lock is not a Python frame, so a thread blocked
+        on the lock shows as sitting on the `with self.lock` line.
+        """
+        if frame.f_globals.get('__name__') != INVENTORY_MODULE:
+            return False
+        key = (frame.f_code.co_filename, frame.f_lineno)
+        is_lock_wait = self._lock_wait_lines.get(key)
+        if is_lock_wait is None:
+            is_lock_wait = self._lock_wait_lines[key] = \
+                'with self.lock' in linecache.getline(*key)
+        return is_lock_wait
+
+
+def _frame_label(frame: FrameType, route_names: dict[CodeType, str]) -> str:
+    code = frame.f_code
+    route_name = route_names.get(code)
+    if route_name is not None:
+        return f'route:{route_name}'
+    module = frame.f_globals.get('__name__', '?')
+    if module == CRUD_MODULE:
+        return f'crud:{code.co_name}'
+    return f'{module}:{code.co_qualname}'
+
+
+profiler = SamplingProfiler()
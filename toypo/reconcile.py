@@ -0,0 +1,138 @@
+"""Inventory Reconciliation
+
+Item inventory moves and PO writes are not one transaction (see
+ExampleItemInventory.transact_item_storage), so the inventory's
+purchased/received/delivered counters can drift from the POs in
+the database. Here we compare the two for the whole catalog, and
+optionally fix the inventory to match the database.
+
+The comparison is done with NumPy arrays over the whole catalog
+at once, so it stays fast for millions of items.
+"""
+import numpy as np
+from sqlalchemy.orm import Session
+
+from . import crud, schemas
+from .inventory import ExampleItemInventory, MoveWatch, NotEnoughItem
+from .models import PurchaseOrderStatus
+
+# Which inventory storage key holds items of POs in each status
+STATUS_STORAGE_KEYS = {
+    PurchaseOrderStatus.PURCHASED: 'purchased',
+    PurchaseOrderStatus.RECEIVED: 'received',
+    PurchaseOrderStatus.DELIVERED: 'delivered',
+}
+
+
+def reconcile_inventory(
+    db: Session,
+    item_inventory: ExampleItemInventory,
+    fix: bool = False
+):
+    """Compare inventory counters against PO item quantity totals
+
+    Drift is the inventory counter minus the PO total, for each storage
+    key. When fixing, the drift is moved between the storage key and
+    'available' so the inventory matches the POs. Each item is fixed
+    atomically. Items that don't have enough to cover the fix (i.e.
+    after a concurrent move) are reported as not fixed and left alone.
+
+    Moves in progress (PO written, inventory not moved yet, or the
+    other way around) show up as drift. Items that had a move in
+    progress at any point while reconciling are reported, but never
+    fixed, since their drift may only be that move.
+
+    Args:
+        db (Session): database
+        item_inventory (ExampleItemInventory): Inventory to reconcile
+        fix (bool, optional): Fix the drift in the inventory. Defaults to False.
+
+    Returns:
+        schemas.InventoryReconciliation: Drifted items and what was fixed
+    """
+    # Started before reading the POs, so moves finishing in between count
+    with item_inventory._watch_moves() as watch:  # pylint: disable=protected-access
+        return _reconcile_inventory(db, item_inventory, fix, watch)
+
+
+def _reconcile_inventory(
+    db: Session,
+    item_inventory: ExampleItemInventory,
+    fix: bool,
+    watch: MoveWatch,
+):
+    totals = crud.get_item_quantity_totals(db)
+
+    with item_inventory.lock:
+        copied = item_inventory._copy_counters()  # pylint: disable=protected-access
+    item_ids, counters = item_inventory._dump_counters(copied)  # pylint: disable=protected-access
+    item_indexes = {item_id: index for index, item_id in enumerate(item_ids)}
+
+    total_indexes = np.fromiter(
+        (item_indexes.get(item_id, -1) for item_id, _, _ in totals),
+        dtype=np.int64, count=len(totals))
+    status_codes = {status: code for code,
+                    status in enumerate(STATUS_STORAGE_KEYS)}
+    total_statuses = np.fromiter(
+        (status_codes[status] for _, status, _ in totals),
+        dtype=np.int64, count=len(totals))
+    total_quantities = np.fromiter(
+        (quantity or 0 for _, _, quantity in totals),
+        dtype=np.int64, count=len(totals))
+    unknown = total_indexes < 0
+
+    drift: dict[str, np.ndarray] = {}
+    for status_code, storage_key in enumerate(STATUS_STORAGE_KEYS.values()):
+        expected = np.zeros(len(item_ids), dtype=np.int64)
+        in_status = (total_statuses == status_code) & ~unknown
+        expected[total_indexes[in_status]] = total_quantities[in_status]
+        drift[storage_key] = np.frombuffer(
+            counters[storage_key], dtype=np.int64) - expected
+
+    storage_keys = list(STATUS_STORAGE_KEYS.values())
+    total_drift = sum(drift[storage_key] for storage_key in storage_keys)
+    drifted_indexes = np.flatnonzero(np.logical_or.reduce(
+        [drift[storage_key] != 0 for storage_key in storage_keys]))
+    # Checked again under the lock when fixing, this skips hopeless fixes
+    fixable = np.frombuffer(counters['available'], dtype=np.int64) \
+        + total_drift >= 0
+
+    drifted_items = []
+    for index in drifted_indexes.tolist():
+        item_id = item_ids[index]
+        item_drift = {storage_key: int(drift[storage_key][index])
+                      for storage_key in storage_keys}
+        fixed = bool(fix and fixable[index]) and _fix_item(
+            item_inventory, item_id, item_drift, watch)
+        drifted_items.append(schemas.ItemDrift(
+            item_id=item_id, fixed=fixed, **item_drift))
+
+    return schemas.InventoryReconciliation(
+        items_checked=len(item_ids),
+        drifted=drifted_items,
+        unknown_item_ids=sorted({
+            totals[index][0] for index in np.flatnonzero(unknown).tolist()}),
+    )
+
+
+def _fix_item(
+    item_inventory: ExampleItemInventory,
+    item_id: str,
+    item_drift: dict[str, int],
+    watch: MoveWatch,
+) -> bool:
+    """Move an item's drift from its storage keys back into 'available'
+
+    Unless the item had a move in progress since the watch started.
+
+    Returns:
+        bool: Whether the item was fixed
+    """
+    changes = {storage_key: -quantity for storage_key,
+               quantity in item_drift.items()}
+    changes['available'] = sum(item_drift.values())
+    try:
+        return item_inventory._change_quantities(  # pylint: disable=protected-access
+            item_id, changes, watch)
+    except NotEnoughItem:
+        return False
@@ -7,9 +7,10 @@ Valid CRUD operations on ORM models are defined here.
 """
 # pylint: disable=missing-class-docstring
 from datetime import datetime
+from functools import lru_cache
 from typing import Optional
 # pylint: disable=no-name-in-module,no-self-argument
-from pydantic import BaseModel, PositiveInt
+from pydantic import BaseModel, PositiveInt, conlist, create_model
 
 from .models import PurchaseOrderStatus
 
@@ -44,6 +45,53 @@ class PurchaseOrderCreate(PurchaseOrderBase):
         }
 
 
+class PurchaseOrderLineBase(BaseModel):
+    """Base PO line item model
+    """
+    item_id: str
+    item_quantity: PositiveInt
+    price_usd: float
+
+
+class PurchaseOrderLineCreate(PurchaseOrderLineBase):
+    """PO line item create fields
+    """
+
+
+class PurchaseOrderLine(PurchaseOrderLineBase):
+    """PO line item as returned to the client
+    """
+    id: PositiveInt
+
+    class Config:
+        orm_mode = True
+
+
+class MultiLinePurchaseOrderCreate(PurchaseOrderBase):
+    """Multi-line PO create operation fields
+
+    price_usd is the total price of the PO.
+    """
+    seller_id: str
+    buyer_id: str
+    price_usd: float
+    purchase_agreement_id: Optional[int] = None
+    lines: conlist(PurchaseOrderLineCreate, min_items=1)  # type: ignore
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "seller_id": "seller123",
+                'buyer_id': 'buyer321',
+                'price_usd': 350,
+                'lines': [
+                    {'item_id': 'item1', 'item_quantity': 2, 'price_usd': 150},
+                    {'item_id': 'item2', 'item_quantity': 5, 'price_usd': 200},
+                ],
+            }
+        }
+
+
 class PurchaseOrderUpdate(PurchaseOrderBase):
     """PO update operation fields
 
@@ -53,18 +101,34 @@ class PurchaseOrderUpdate(PurchaseOrderBase):
     status: Optional[PurchaseOrderStatus] = None
 
 
+class PurchaseOrderTransition(BaseModel):
+    """POs to move to another status at once
+    """
+    purchase_order_ids: conlist(PositiveInt, min_items=1)  # type: ignore
+
+    class Config:
+        schema_extra = {
+            "example": {
+                'purchase_order_ids': [1, 2, 3],
+            }
+        }
+
+
 class PurchaseOrder(PurchaseOrderBase):
     """PO model as returned to the client
+
+    item_id and item_quantity are empty for multi-line POs.
     """
     id: PositiveInt
     seller_id: str
     buyer_id: str
-    item_id: str
-    item_quantity: int
+    item_id: Optional[str] = None
+    item_quantity: Optional[int] = None
     price_usd: float
     purchase_agreement_id: Optional[int] = None
     status: PurchaseOrderStatus
     created_at: datetime
+    lines: list[PurchaseOrderLine] = []
 
     class Config:
         orm_mode = True
@@ -110,3 +174,47 @@ class PurchaseAgreement(PurchaseAgreementBase):
 
     class Config:
         orm_mode = True
+
+
+class ItemDrift(BaseModel):
+    """Inventory counters minus PO totals, for one item
+
+    Positive means the inventory tracks more than the POs account for.
+    """
+    item_id: str
+    purchased: int
+    received: int
+    delivered: int
+    fixed: bool
+
+
+class InventoryReconciliation(BaseModel):
+    """Result of reconciling the item inventory against POs
+    """
+    items_checked: int
+    drifted: list[ItemDrift]
+    unknown_item_ids: list[str]
+
+
+@lru_cache(maxsize=256)
+def sparse_model(model: type[BaseModel], fields: frozenset[str]) -> type[BaseModel]:
+    """Build a copy of a model with only some of its fields
+
+    Used for sparse fieldsets (`fields=` query parameter) on responses.
+    Models are cached per field set.
+
+    Args:
+        model (type[BaseModel]): Model to copy fields from
+        fields (frozenset[str]): Fields to keep
+
+    Returns:
+        type[BaseModel]: Model with only the given fields
+    """
+    return create_model(  # type: ignore
+        f'{model.__name__}Fields',
+        __config__=model.__config__,
+        **{
+            name: (field.outer_type_, field.field_info)
+            for name, field in model.__fields__.items() if name in fields
+        },
+    )
@@ -0,0 +1,159 @@
+"""Request Coalescing (single-flight)
+
+When several threads ask for the same thing at once (i.e. the same
+PO during an incident), only the first one runs the query. The
+others wait for its result and share it.
+
+Only calls that are in flight at the same time are coalesced, this
+is not a cache: a call made after another one finished runs again.
+A call that joins a flight gets the result of a function that may
+have started before it, so writers should `forget` the keys they
+made stale once they commit.
+"""
+from threading import Event, Lock
+from typing import Any, Callable, Hashable, Optional, TypeVar
+
+from . import metrics
+
+T = TypeVar('T')
+
+
+class SingleFlightTimeout(Exception):
+    """Single-flight timeout
+
+    Should be raised if a call waited on another call with the
+    same key for longer than the timeout.
+    """
+
+
+class SharedCallError(Exception):
+    """Shared call failed
+
+    Should be raised in calls that waited on another call that
+    raised, with that exception as the cause.
+    """
+
+
+class _Call:
+    """A call in flight, and its outcome once done
+    """
+
+    def __init__(self) -> None:
+        self.done = Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+
+
+class SingleFlight:
+    """Coalesce concurrent calls with the same key
+    """
+
+    def __init__(
+        self,
+        max_keys: int = 1024,
+        timeout: float = 5.0,
+        metrics_name: Optional[str] = None,
+    ) -> None:
+        """Initialize the single-flight group
+
+        Args:
+            max_keys (int, optional): Keys in flight at once. Calls for new
+                keys past this are not coalesced. Defaults to 1024.
+            timeout (float, optional): Seconds a call waits on another one
+                with the same key, before giving up. Defaults to 5.0.
+            metrics_name (Optional[str], optional): Name to register
+                metrics as, or None to not register them. Defaults to None.
+        """
+        self.max_keys = max_keys
+        self.timeout = timeout
+        self._calls: dict[Hashable, _Call] = {}
+        self._lock = Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.bypassed = 0
+        if metrics_name is not None:
+            metrics.register(metrics_name, self.stats)
+
+    def stats(self) -> dict[str, Any]:
+        """Calls, how many were coalesced, and keys in flight
+        """
+        return {
+            'calls': self.calls,
+            'coalesced': self.coalesced,
+            'coalescing_ratio': self.coalesced / self.calls if self.calls else 0.0,
+            'timeouts': self.timeouts,
+            'bypassed': self.bypassed,
+            'keys_in_flight': len(self._calls),
+        }
+
+    def do(self, key: Hashable, function: Callable[[], T]) -> T:  # pylint: disable=invalid-name
+        """Run function, or wait for the result of a call with the same key
+
+        Exceptions are shared too: if the call that ran function raised,
+        every call waiting on it raises SharedCallError from it.
+
+        Args:
+            key (Hashable): Calls with equal keys are coalesced
+            function (Callable[[], T]): Function to run
+
+        Raises:
+            SingleFlightTimeout: If the call with the same key took too long.
+                Running function again would only add to the load
+                that is making it slow.
+            SharedCallError: If the call with the same key raised
+
+        Returns:
+            T: Result of function
+        """
+        leader = False
+        with self._lock:
+            self.calls += 1
+            call = self._calls.get(key)
+            if call is not None:
+                self.coalesced += 1
+            elif len(self._calls) >= self.max_keys:
+                self.bypassed += 1
+            else:
+                call = self._calls[key] = _Call()
+                leader = True
+
+        if call is None:
+            return function()
+        if leader:
+            return self._lead(key, call, function)
+        if not call.done.wait(self.timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise SingleFlightTimeout(
+                f'Gave up waiting on a call after {self.timeout} seconds')
+        if call.error is not None:
+            raise SharedCallError('Shared call failed') from call.error
+        return call.result
+
+    def forget(self, match: Callable[[Hashable], bool]):
+        """End the flights of matching keys
+
+        Calls already waiting still get the result of the call they
+        waited on, but later calls with the same key run function again.
+
+        Args:
+            match (Callable[[Hashable], bool]): True for keys to forget
+        """
+        with self._lock:
+            for key in [key for key in self._calls if match(key)]:
+                del self._calls[key]
+
+    def _lead(self, key: Hashable, call: _Call, function: Callable[[], T]) -> T:
+        try:
+            call.result = function()
+            return call.result
+        except BaseException as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                # Unless forgotten, and maybe replaced by a newer call
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            call.done.set()
@@ -0,0 +1,105 @@
+"""Tests on admission control middleware
+"""
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from .admission import AdmissionControl, TokenBucket
+from .main import app as main_app
+
+app = FastAPI()
+app.add_middleware(AdmissionControl, rate=0.001, burst=2,
+                   max_concurrent_writes=4, buyers=['b1', 'b2', 'b3'],
+                   shared_rate=0.001, shared_burst=2, metrics_name=None)
+
+
+@app.post('/write')
+def write():
+    """Write route"""
+    return {}
+
+
+@app.get('/read')
+def read():
+    """Read route"""
+    return {}
+
+
+client = TestClient(app)
+
+
+def _admission() -> AdmissionControl:
+    """The middleware instance of the test app
+    """
+    # The middleware stack is only built on the first request
+    client.get('/read')
+    middleware = app.middleware_stack.app  # type: ignore
+    while not isinstance(middleware, AdmissionControl):
+        middleware = middleware.app
+    return middleware
+
+
+def test_token_bucket():
+    """Buckets refill at their rate, up to their burst
+    """
+    bucket = TokenBucket(rate=2, burst=2, now=0)
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == 0
+    assert bucket.take(0) == 0.5
+    assert bucket.take(0.5) == 0
+    assert bucket.take(100) == 0
+    assert bucket.take(100) == 0
+    assert bucket.take(100) > 0
+
+
+def test_rate_limit_per_buyer():
+    """A buyer over its rate is rejected, other buyers and reads are not
+    """
+    for _ in range(2):
+        assert client.post('/write', headers={'X-Buyer-Id': 'b1'}).status_code == 200
+    rejected = client.post('/write', headers={'X-Buyer-Id': 'b1'})
+    assert rejected.status_code == 429
+    assert int(rejected.headers['Retry-After']) > 0
+    assert client.post('/write', headers={'X-Buyer-Id': 'b2'}).status_code == 200
+    assert client.get('/read', headers={'X-Buyer-Id': 'b1'}).status_code == 200
+    assert _admission().stats()['rejected_rate_limited'] == 1
+
+
+def test_unknown_buyers_share_a_bucket():
+    """Made up buyer IDs and requests without one share one bucket,
+    and don't take from known buyers' buckets
+    """
+    admission = _admission()
+    tracked_buyers = admission.stats()['tracked_buyers']
+    assert client.post('/write', headers={'X-Buyer-Id': 'made-up-1'}).status_code == 200
+    assert client.post('/write').status_code == 200
+    rejected = client.post('/write', headers={'X-Buyer-Id': 'made-up-2'})
+    assert rejected.status_code == 429
+    assert int(rejected.headers['Retry-After']) > 0
+    assert client.post('/write').status_code == 429
+    assert client.post('/write', headers={'X-Buyer-Id': 'b3'}).status_code == 200
+    assert admission.stats()['tracked_buyers'] == tracked_buyers + 1
+    assert admission.stats()['rejected_shared_rate_limited'] == 2
+
+
+def test_concurrency_cap():
+    """Writes over the concurrency cap are rejected
+    """
+    admission = _admission()
+    admission.in_flight = 4
+    try:
+        rejected = client.post('/write', headers={'X-Buyer-Id': 'b3'})
+    finally:
+        admission.in_flight = 0
+    assert rejected.status_code == 429
+    assert rejected.headers['Retry-After'] == '1'
+    assert admission.stats()['rejected_concurrency'] == 1
+
+
+def test_admission_metrics():
+    """Admission counters show up in the admin metrics
+    """
+    main_client = TestClient(main_app)
+    response = main_client.get('/admin/metrics', headers={
+        'X-Admin-Token': 'test-admin-token'})
+    assert response.status_code == 200
+    assert response.json()['admission']['queue_depth'] == 0
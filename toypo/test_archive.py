@@ -0,0 +1,90 @@
+"""Tests on archiving old POs
+"""
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from .archive import archive_purchase_orders
+from .database import SessionLocal
+from .main import app
+
+client = TestClient(app)
+
+
+def test_archive_purchase_orders():
+    """Done POs are archived in chunks and can still be read
+    """
+    for item_id in ['item1', 'item2', 'item1']:
+        response = client.post('/purchase_orders', json={
+            'seller_id': 'seller123',
+            'buyer_id': 'buyer123',
+            'item_id': item_id,
+            'item_quantity': 2,
+            'price_usd': 350.5,
+        })
+        assert response.status_code == 200
+    response = client.post('/purchase_orders/multi_line', json={
+        'seller_id': 'seller123',
+        'buyer_id': 'buyer123',
+        'price_usd': 400,
+        'lines': [
+            {'item_id': 'item1', 'item_quantity': 2, 'price_usd': 100},
+            {'item_id': 'item2', 'item_quantity': 5, 'price_usd': 200},
+        ],
+    })
+    assert response.status_code == 200
+    assert client.post('/purchase_orders/receive', json={
+        'purchase_order_ids': [1, 2, 4]}).status_code == 200
+    assert client.post('/purchase_orders/deliver/2').status_code == 200
+    before = {po['id']: po for po in client.get('/purchase_orders/').json()}
+
+    with SessionLocal() as db:
+        assert archive_purchase_orders(
+            db, datetime.utcnow() - timedelta(days=1), chunk_size=2) == 0
+        assert archive_purchase_orders(
+            db, datetime.utcnow() + timedelta(days=1), chunk_size=2) == 3
+
+    assert [po['id'] for po in client.get('/purchase_orders/').json()] == [3]
+    for purchase_order_id in [1, 2, 4]:
+        response = client.get(f'/purchase_orders/{purchase_order_id}')
+        assert response.status_code == 200
+        assert response.json() == before[purchase_order_id]
+    assert client.post('/purchase_orders/deliver/1').status_code == 400
+
+    response = client.post('/admin/inventory/reconcile', headers={
+        'X-Admin-Token': 'test-admin-token'})
+    assert response.json()['drifted'] == []
+
+
+def test_ids_not_reused_after_archiving():
+    """A PO created after the newest PO is archived gets a new ID
+    """
+    def create_purchase_order():
+        response = client.post('/purchase_orders/multi_line', json={
+            'seller_id': 'seller123',
+            'buyer_id': 'buyer123',
+            'price_usd': 100,
+            'lines': [{'item_id': 'item1', 'item_quantity': 1, 'price_usd': 100}],
+        })
+        assert response.status_code == 200
+        return response.json()
+
+    def receive_and_archive(purchase_order):
+        assert client.post(
+            f'/purchase_orders/receive/{purchase_order["id"]}').status_code == 200
+        with SessionLocal() as db:
+            assert archive_purchase_orders(
+                db, datetime.utcnow() + timedelta(days=1), chunk_size=10) == 1
+
+    purchase_orders = [create_purchase_order()]
+    for _ in range(2):
+        receive_and_archive(purchase_orders[-1])
+        # The next PO must not take over the archived PO's IDs
+        purchase_orders.append(create_purchase_order())
+        assert purchase_orders[-1]['id'] > purchase_orders[-2]['id']
+        assert purchase_orders[-1]['lines'][0]['id'] > purchase_orders[-2]['lines'][0]['id']
+
+    for purchase_order in purchase_orders[:-1]:
+        response = client.get(f'/purchase_orders/{purchase_order["id"]}')
+        assert response.json()['status'] == 'RECEIVED'
+        assert response.json()['lines'] == purchase_order['lines']
@@ -0,0 +1,151 @@
+"""Tests on response compression and sparse fieldsets
+"""
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+from .compression import ENCODERS, CompressionMiddleware, negotiate_encoding
+from .constants import COMPRESSION_MIN_SIZE
+from .database import engine
+from .main import app as main_app
+
+app = FastAPI()
+app.add_middleware(CompressionMiddleware, min_size=100, metrics_name=None)
+
+
+@app.get('/big')
+def big():
+    """Big response"""
+    return {'data': 'x' * 1000}
+
+
+@app.get('/small')
+def small():
+    """Small response"""
+    return {'data': 'x'}
+
+
+client = TestClient(app)
+main_client = TestClient(main_app)
+
+
+def test_negotiate_encoding():
+    """Best accepted encoding wins, q=0 is refused
+    """
+    preferred = next(iter(ENCODERS))
+    assert negotiate_encoding('gzip, deflate, br, zstd') == preferred
+    assert negotiate_encoding('gzip, br;q=0.5') == 'gzip'
+    assert negotiate_encoding('gzip;q=0, identity') is None
+    assert negotiate_encoding('*') == preferred
+    assert negotiate_encoding('') is None
+
+
+def test_compress_big_responses_only():
+    """Responses over the threshold are compressed with the negotiated encoding
+    """
+    response = client.get('/big', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.json() == {'data': 'x' * 1000}
+
+    response = client.get('/small', headers={'Accept-Encoding': 'gzip'})
+    assert 'Content-Encoding' not in response.headers
+    response = client.get('/big', headers={'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+
+
+def test_compress_zstd():
+    """zstd is used when the client accepts it and zstandard is installed
+    """
+    zstandard = pytest.importorskip('zstandard')
+    response = client.get('/big', headers={'Accept-Encoding': 'zstd'})
+    assert response.headers['Content-Encoding'] == 'zstd'
+    assert zstandard.ZstdDecompressor().decompress(response.content) == \
+        b'{"data":"' + b'x' * 1000 + b'"}'
+
+
+def _compression_metrics() -> dict:
+    response = main_client.get('/admin/metrics', headers={
+        'X-Admin-Token': 'test-admin-token', 'Accept-Encoding': 'identity'})
+    assert 'Content-Encoding' not in response.headers
+    return response.json()['compression']
+
+
+def test_compression_metrics():
+    """Bytes saved by compressing a big list show up in the admin metrics
+    """
+    for _ in range(10):
+        response = main_client.post('/purchase_orders', json={
+            'seller_id': 'seller123',
+            'buyer_id': 'buyer123',
+            'item_id': 'item1',
+            'item_quantity': 1,
+            'price_usd': 350.5,
+        })
+        assert response.status_code == 200
+    plain = main_client.get('/purchase_orders/', headers={
+        'Accept-Encoding': 'identity'})
+    assert len(plain.content) > COMPRESSION_MIN_SIZE
+
+    before = _compression_metrics()
+    response = main_client.get('/purchase_orders/', headers={
+        'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.content == plain.content
+    after = _compression_metrics()
+
+    compressed_size = int(response.headers['Content-Length'])
+    assert compressed_size < len(plain.content)
+    assert after['responses']['gzip'] == before['responses']['gzip'] + 1
+    assert after['bytes_in'] == before['bytes_in'] + len(plain.content)
+    assert after['bytes_saved'] == \
+        before['bytes_saved'] + len(plain.content) - compressed_size
+
+
+def _create_pa_and_po():
+    response = main_client.post('/purchase_agreements', json={
+        'seller_id': 'seller123',
+        'buyer_id': 'buyer123',
+        'item_id': 'item1',
+        'item_quantity': 9,
+        'price_usd': 350.5,
+    })
+    assert response.status_code == 200
+    response = main_client.post('/purchase_orders', json={
+        'seller_id': 'seller123',
+        'buyer_id': 'buyer123',
+        'item_id': 'item1',
+        'item_quantity': 9,
+        'price_usd': 350.5,
+        'purchase_agreement_id': 1
+    })
+    assert response.status_code == 200
+
+
+def test_sparse_fieldsets():
+    """Only requested fields are selected and returned
+    """
+    _create_pa_and_po()
+    statements = []
+
+    def before_execute(conn, cursor, statement, *args):  # pylint: disable=unused-argument
+        statements.append(statement)
+
+    event.listen(engine, 'before_cursor_execute', before_execute)
+    try:
+        response = main_client.get('/purchase_orders/?fields=id,status')
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_execute)
+    assert response.json() == [{'id': 1, 'status': 'PURCHASED'}]
+    selects = [statement for statement in statements
+               if statement.startswith('SELECT')]
+    assert len(selects) == 1
+    assert 'seller_id' not in selects[0]
+
+    response = main_client.get('/purchase_agreements/?fields=id,item_id')
+    assert response.json() == [{'id': 1, 'item_id': 'item1'}]
+    response = main_client.get('/purchase_agreements/?fields=id,purchase_orders')
+    assert response.json()[0]['purchase_orders'][0]['id'] == 1
+
+    assert main_client.get('/purchase_orders/?fields=id,bogus').status_code == 400
+    assert main_client.get('/purchase_orders/?fields=').status_code == 400
@@ -0,0 +1,186 @@
+"""Tests on the item inventory engines
+"""
+# pylint: disable=protected-access,redefined-outer-name
+import pytest
+
+from .inventory import (CompactItemInventory, ExampleItemInventory,
+                        InventoryJournal, ItemNotFound, NotEnoughItem,
+                        SnapshotError)
+
+
+@pytest.fixture(params=[ExampleItemInventory, CompactItemInventory])
+def inventory(request):
+    """Fresh inventory for every engine
+    """
+    return request.param()
+
+
+def test_check_item(inventory):
+    """Both engines start with the same example items
+    """
+    assert inventory.check_item('item3') == {
+        'available': 1, 'purchased': 0, 'received': 0, 'delivered': 0}
+    with pytest.raises(ItemNotFound):
+        inventory.check_item('nope')
+
+
+def test_transact_item_storage(inventory):
+    """Moving items between storage keys
+    """
+    with inventory.transact_item_storage('item1', 'available', 'purchased', 3):
+        pass
+    assert inventory.check_item('item1')['available'] == 97
+    assert inventory.check_item('item1')['purchased'] == 3
+
+
+def test_transact_item_storage_rolls_back(inventory):
+    """Exceptions while yielding move items back to the source
+    """
+    with pytest.raises(RuntimeError):
+        with inventory.transact_item_storage('item1', 'available', 'purchased', 3):
+            raise RuntimeError('failed')
+    assert inventory.check_item('item1')['available'] == 100
+    assert inventory.check_item('item1')['purchased'] == 0
+
+
+def test_not_enough_item(inventory):
+    """Subtracting more than there is leaves the inventory untouched
+    """
+    with pytest.raises(NotEnoughItem):
+        inventory._sub_quantity('item3', 'available', 2)
+    assert inventory.check_item('item3')['available'] == 1
+    with pytest.raises(ItemNotFound):
+        inventory._add_quantity('nope', 'available', 2)
+
+
+def test_change_quantities_is_atomic(inventory):
+    """Several storage keys of an item change together, or not at all
+    """
+    inventory._change_quantities('item1', {'available': -3, 'received': 3})
+    assert inventory.check_item('item1')['available'] == 97
+    assert inventory.check_item('item1')['received'] == 3
+    with pytest.raises(NotEnoughItem):
+        inventory._change_quantities('item1', {'available': 5, 'received': -4})
+    assert inventory.check_item('item1')['available'] == 97
+    assert inventory.check_item('item1')['received'] == 3
+
+
+def test_watch_moves(inventory):
+    """Items with moves in progress when the watch starts, or started
+    since, are unsettled, and can't be changed through the watch
+    """
+    with inventory.transact_item_storage('item1', 'available', 'purchased', 1):
+        with inventory._watch_moves() as watch:
+            with pytest.raises(RuntimeError):
+                with inventory.transact_items_storage(
+                        {'item2': 1}, 'available', 'purchased'):
+                    raise RuntimeError('failed')
+            assert watch.unsettled == {'item1', 'item2'}
+            assert not inventory._change_quantities('item2', {'available': 1}, watch)
+            assert inventory._change_quantities('item3', {'available': 1}, watch)
+    assert inventory.pending_moves == {}
+    assert inventory.check_item('item2')['available'] == 100
+    assert inventory.check_item('item3')['available'] == 2
+
+
+def test_add_item(inventory):
+    """Adding new items, and overwriting existing ones
+    """
+    inventory.add_item('item5', {
+        'available': 5, 'purchased': 1, 'received': 0, 'delivered': 0})
+    inventory.add_item('item1', {
+        'available': 1, 'purchased': 0, 'received': 0, 'delivered': 0})
+    assert inventory.check_item('item5')['purchased'] == 1
+    assert inventory.check_item('item1')['available'] == 1
+    assert inventory.check_item('item2')['available'] == 100
+
+
+def _all_items(inventory):
+    return {item_id: dict(inventory.check_item(item_id))
+            for item_id in ['item1', 'item2', 'item3', 'item4', 'item5']}
+
+
+def test_snapshot_and_restore(inventory, tmp_path):
+    """Restoring gets back moves from before and after the last snapshot
+    """
+    snapshot_path = str(tmp_path / 'inventory.snapshot')
+    journal = InventoryJournal(inventory, snapshot_path)
+    journal.restore()
+    with inventory.transact_item_storage('item1', 'available', 'purchased', 3):
+        pass
+    inventory.add_item('item5', {
+        'available': 5, 'purchased': 0, 'received': 0, 'delivered': 0})
+    journal.snapshot()
+    with inventory.transact_item_storage('item1', 'purchased', 'received', 2):
+        pass
+    with inventory.transact_item_storage('item5', 'available', 'purchased', 1):
+        pass
+    expected = _all_items(inventory)
+    journal.close()
+
+    for engine in [ExampleItemInventory, CompactItemInventory]:
+        restored = engine()
+        restored_journal = InventoryJournal(restored, snapshot_path)
+        restored_journal.restore()
+        assert restored_journal.generation == 1
+        assert _all_items(restored) == expected
+        restored_journal.close()
+
+
+def test_restore_without_snapshot_replays_move_log(inventory, tmp_path):
+    """Moves are recovered even if no snapshot was ever taken,
+    and a record cut off halfway is ignored and dropped
+    """
+    snapshot_path = str(tmp_path / 'inventory.snapshot')
+    journal = InventoryJournal(inventory, snapshot_path)
+    journal.restore()
+    with inventory.transact_item_storage('item2', 'available', 'purchased', 7):
+        pass
+    journal.close()
+    with open(f'{snapshot_path}.0.log', 'ab') as log:
+        log.write(b'\x00\x05\x00ite')
+
+    restored = ExampleItemInventory()
+    journal = InventoryJournal(restored, snapshot_path)
+    journal.restore()
+    assert restored.check_item('item2')['available'] == 93
+    assert restored.check_item('item2')['purchased'] == 7
+
+    # Moves logged after the restart must not land behind the cut off record
+    with restored.transact_item_storage('item2', 'available', 'purchased', 3):
+        pass
+    journal.close()
+    restored_again = ExampleItemInventory()
+    InventoryJournal(restored_again, snapshot_path).restore()
+    assert restored_again.check_item('item2')['available'] == 90
+    assert restored_again.check_item('item2')['purchased'] == 10
+
+
+def test_restore_bad_snapshot(inventory, tmp_path):
+    """Files that aren't snapshots are refused
+    """
+    snapshot_path = tmp_path / 'inventory.snapshot'
+    snapshot_path.write_bytes(b'not a snapshot, but long enough to have a header')
+    with pytest.raises(SnapshotError):
+        InventoryJournal(inventory, str(snapshot_path)).restore()
+
+
+def test_transact_items_storage_is_atomic(inventory):
+    """Several items move together, or not at all
+    """
+    with inventory.transact_items_storage(
+            {'item1': 3, 'item3': 1}, 'available', 'purchased'):
+        pass
+    assert inventory.check_item('item1')['purchased'] == 3
+    assert inventory.check_item('item3')['purchased'] == 1
+
+    with pytest.raises(NotEnoughItem):
+        with inventory.transact_items_storage(
+                {'item2': 3, 'item3': 1}, 'available', 'purchased'):
+            pass
+    assert inventory.check_item('item2')['available'] == 100
+    with pytest.raises(ItemNotFound):
+        with inventory.transact_items_storage(
+                {'item2': 3, 'nope': 1}, 'available', 'purchased'):
+            pass
+    assert inventory.check_item('item2')['available'] == 100
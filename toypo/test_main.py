@@ -1,7 +1,9 @@
 """Tests on general FastAPI application
 """
 from fastapi.testclient import TestClient
+from sqlalchemy import event
 
+from .database import engine
 from .inventory import item_inventory
 from .main import app
 
@@ -113,3 +115,183 @@ def test_create_pa_and_po():
     assert new_po_response.json()['purchase_agreement_id'] == 1
     assert item_inventory.check_item('item1')['available'] == 91
     assert item_inventory.check_item('item1')['purchased'] == 9
+
+
+def test_create_multi_line_purchase_order_and_receive_it():
+    """Create a PO with several lines, read it back and receive it
+
+    Lines for the same item are reserved together, all lines are
+    inserted with one statement, and listing POs loads every line
+    with one extra query.
+    """
+    statements = []
+
+    def before_execute(conn, cursor, statement, parameters, *args):  # pylint: disable=unused-argument
+        statements.append((statement, parameters))
+
+    event.listen(engine, 'before_cursor_execute', before_execute)
+    try:
+        new_po_response = client.post('/purchase_orders/multi_line', json={
+            'seller_id': 'seller123',
+            'buyer_id': 'buyer123',
+            'price_usd': 400,
+            'lines': [
+                {'item_id': 'item1', 'item_quantity': 2, 'price_usd': 100},
+                {'item_id': 'item2', 'item_quantity': 5, 'price_usd': 200},
+                {'item_id': 'item1', 'item_quantity': 1, 'price_usd': 100},
+            ],
+        })
+        line_inserts = [parameters for statement, parameters in statements
+                        if statement.startswith('INSERT INTO purchase_order_lines')]
+        statements.clear()
+        client.post('/purchase_orders/multi_line', json={
+            'seller_id': 'seller123',
+            'buyer_id': 'buyer123',
+            'price_usd': 100,
+            'lines': [
+                {'item_id': 'item2', 'item_quantity': 1, 'price_usd': 50},
+                {'item_id': 'item2', 'item_quantity': 1, 'price_usd': 50},
+            ],
+        })
+        statements.clear()
+        read_response = client.get('/purchase_orders/')
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_execute)
+    assert new_po_response.status_code == 200
+    assert len(line_inserts) == 1
+    assert len(line_inserts[0]) == 3
+    line_selects = [statement for statement, _ in statements
+                    if statement.startswith('SELECT') and
+                    'FROM purchase_order_lines' in statement]
+    assert len(line_selects) == 1
+    assert [len(po['lines']) for po in read_response.json()] == [3, 2]
+
+    assert new_po_response.json()['item_id'] is None
+    assert [(line['item_id'], line['item_quantity'])
+            for line in new_po_response.json()['lines']] == [
+        ('item1', 2), ('item2', 5), ('item1', 1)]
+    assert item_inventory.check_item('item1')['purchased'] == 3
+    assert item_inventory.check_item('item2')['purchased'] == 7
+    assert read_response.json()[0]['lines'] == new_po_response.json()['lines']
+
+    rec_po_response = client.post('/purchase_orders/receive/1')
+    assert rec_po_response.status_code == 200
+    assert item_inventory.check_item('item1')['purchased'] == 0
+    assert item_inventory.check_item('item1')['received'] == 3
+    assert item_inventory.check_item('item2')['received'] == 5
+    assert item_inventory.check_item('item2')['purchased'] == 2
+
+
+def test_create_multi_line_po_too_many_items():
+    """If one line can't be reserved, no line is
+    """
+    new_po_response = client.post('/purchase_orders/multi_line', json={
+        'seller_id': 'seller123',
+        'buyer_id': 'buyer123',
+        'price_usd': 400,
+        'lines': [
+            {'item_id': 'item1', 'item_quantity': 2, 'price_usd': 100},
+            {'item_id': 'item3', 'item_quantity': 2, 'price_usd': 200},
+        ],
+    })
+    assert new_po_response.status_code == 400
+    assert item_inventory.check_item('item1')['available'] == 100
+    assert item_inventory.check_item('item3')['available'] == 1
+    assert client.get('/purchase_orders/').json() == []
+
+
+def _create_po(item_id: str, item_quantity: int) -> int:
+    response = client.post('/purchase_orders', json={
+        'seller_id': 'seller123',
+        'buyer_id': 'buyer123',
+        'item_id': item_id,
+        'item_quantity': item_quantity,
+        'price_usd': 350.5,
+    })
+    assert response.status_code == 200
+    return response.json()['id']
+
+
+def test_receive_and_deliver_purchase_orders_in_batch():
+    """Receive and deliver several POs at once
+
+    Inventory moves along, and POs in the wrong status are refused.
+    """
+    first_id = _create_po('item1', 3)
+    second_id = _create_po('item1', 4)
+    third_id = _create_po('item2', 5)
+
+    response = client.post('/purchase_orders/deliver/1')
+    assert response.status_code == 400
+    assert response.json()['detail'] == 'Can only deliver a PO from received status'
+
+    response = client.post('/purchase_orders/receive', json={
+        'purchase_order_ids': [first_id, second_id, third_id]})
+    assert response.status_code == 200
+    assert [po['status'] for po in response.json()] == ['RECEIVED'] * 3
+    assert item_inventory.check_item('item1')['purchased'] == 0
+    assert item_inventory.check_item('item1')['received'] == 7
+    assert item_inventory.check_item('item2')['received'] == 5
+
+    response = client.post(f'/purchase_orders/deliver/{first_id}')
+    assert response.status_code == 200
+    assert response.json()['status'] == 'DELIVERED'
+    assert item_inventory.check_item('item1')['received'] == 4
+    assert item_inventory.check_item('item1')['delivered'] == 3
+
+    # One PO already delivered: nothing happens to the other
+    response = client.post('/purchase_orders/deliver', json={
+        'purchase_order_ids': [first_id, second_id]})
+    assert response.status_code == 400
+    assert client.get(f'/purchase_orders/{second_id}').json()['status'] == 'RECEIVED'
+    assert item_inventory.check_item('item1')['received'] == 4
+
+    response = client.post('/purchase_orders/deliver', json={
+        'purchase_order_ids': [second_id, 387]})
+    assert response.status_code == 404
+    assert client.post('/purchase_orders/receive/387').status_code == 404
+
+
+def test_create_po_mismatched_pa_uses_cached_pa():
+    """POs are validated against a cached PA before claiming inventory
+    """
+    new_pa_response = client.post('/purchase_agreements', json={
+        'seller_id': 'seller123',
+        'buyer_id': 'buyer123',
+        'item_id': 'item1',
+        'item_quantity': 9,
+        'price_usd': 350.5,
+    })
+    assert new_pa_response.status_code == 200
+    with item_inventory._watch_moves() as watch:  # pylint: disable=protected-access
+        new_po_response = client.post('/purchase_orders', json={
+            'seller_id': 'seller123',
+            'buyer_id': 'buyer123',
+            'item_id': 'item3',
+            'item_quantity': 1,
+            'price_usd': 350.5,
+            'purchase_agreement_id': 1
+        })
+        assert new_po_response.status_code == 400
+        assert new_po_response.json()['detail'] == \
+            'item_id must match one in the Purchase Agreement'
+        new_po_response = client.post('/purchase_orders/multi_line', json={
+            'seller_id': 'seller123',
+            'buyer_id': 'buyer123',
+            'price_usd': 400,
+            'purchase_agreement_id': 1,
+            'lines': [
+                {'item_id': 'item1', 'item_quantity': 2, 'price_usd': 100},
+                {'item_id': 'item3', 'item_quantity': 1, 'price_usd': 300},
+            ],
+        })
+        assert new_po_response.status_code == 400
+    # Rejected before any stock was claimed
+    assert watch.unsettled == set()
+    assert client.get('/purchase_orders/').json() == []
+    assert item_inventory.check_item('item3')['available'] == 1
+
+    metrics_response = client.get('/admin/metrics', headers={
+        'X-Admin-Token': 'test-admin-token'})
+    assert metrics_response.json()['purchase_agreement_cache'] == {
+        'hits': 1, 'misses': 1, 'size': 1, 'max_size': 1024}
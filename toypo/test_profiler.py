@@ -0,0 +1,80 @@
+"""Tests on the sampling profiler
+"""
+import threading
+
+from fastapi.testclient import TestClient
+
+from .crud import purchase_agreement_cache
+from .inventory import ExampleItemInventory
+from .main import app
+from .profiler import SamplingProfiler
+
+client = TestClient(app)
+
+
+class BlockingSession:
+    """Stand-in DB session that blocks on query until released"""
+
+    def __init__(self, release: threading.Event) -> None:
+        self.release = release
+
+    def query(self, *_):
+        """Block"""
+        self.release.wait()
+        return self
+
+    def filter(self, *_):
+        """No-op"""
+        return self
+
+    def first(self):
+        """No PA"""
+        return None
+
+
+def test_profile_labels():
+    """Route handlers, CRUD functions and inventory lock waits are labelled
+    """
+    release = threading.Event()
+
+    def handler():
+        release.wait()
+
+    inventory = ExampleItemInventory()
+    threads = [
+        threading.Thread(target=handler, name='route-thread'),
+        threading.Thread(target=inventory._add_quantity,  # pylint: disable=protected-access
+                         args=('item1', 'available', 1), name='lock-thread'),
+        threading.Thread(target=purchase_agreement_cache.get,
+                         args=(BlockingSession(release), 1), name='crud-thread'),
+    ]
+    with inventory.lock:
+        for thread in threads:
+            thread.start()
+        try:
+            collapsed = SamplingProfiler().profile(
+                0.05, 0.005, {handler.__code__: 'handler'})
+        finally:
+            release.set()
+    for thread in threads:
+        thread.join()
+
+    stacks = dict(line.rsplit(' ', 1) for line in collapsed.splitlines())
+    assert all(int(count) > 0 for count in stacks.values())
+    assert any(stack.startswith('route-thread;') and 'route:handler' in stack
+               for stack in stacks)
+    assert any(stack.startswith('lock-thread;') and stack.endswith('inventory:lock_wait')
+               for stack in stacks)
+    assert any(stack.startswith('crud-thread;') and 'crud:get' in stack
+               for stack in stacks)
+
+
+def test_profile_endpoint():
+    """Profiling is admin-only, and returns collapsed stacks
+    """
+    assert client.post('/admin/profile?seconds=0.01').status_code == 403
+    response = client.post('/admin/profile?seconds=0.05&interval_ms=5', headers={
+        'X-Admin-Token': 'test-admin-token'})
+    assert response.status_code == 200
+    assert response.headers['content-type'].startswith('text/plain')
+    assert response.text.endswith('\n')
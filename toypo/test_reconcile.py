@@ -0,0 +1,154 @@
+"""Tests on inventory reconciliation against POs
+"""
+# pylint: disable=protected-access
+from fastapi.testclient import TestClient
+
+from . import crud, schemas
+from .database import SessionLocal
+from .inventory import item_inventory
+from .main import app
+from .reconcile import reconcile_inventory
+
+client = TestClient(app)
+
+ADMIN_HEADERS = {'X-Admin-Token': 'test-admin-token'}
+
+
+def test_reconcile_requires_admin():
+    """Admin routes need the admin token
+    """
+    assert client.post('/admin/inventory/reconcile').status_code == 403
+    assert client.post('/admin/inventory/reconcile', headers={
+        'X-Admin-Token': 'wrong'}).status_code == 403
+
+
+def _create_drift():
+    """Create POs, then drift item1 by -3 and item2 by +5 purchased
+    """
+    new_po_response = client.post('/purchase_orders', json={
+        'seller_id': 'seller123',
+        'buyer_id': 'buyer123',
+        'item_id': 'item1',
+        'item_quantity': 3,
+        'price_usd': 350.5,
+    })
+    assert new_po_response.status_code == 200
+    new_po_response = client.post('/purchase_orders/multi_line', json={
+        'seller_id': 'seller123',
+        'buyer_id': 'buyer123',
+        'price_usd': 400,
+        'lines': [
+            {'item_id': 'item1', 'item_quantity': 2, 'price_usd': 100},
+            {'item_id': 'item2', 'item_quantity': 5, 'price_usd': 200},
+        ],
+    })
+    assert new_po_response.status_code == 200
+    response = client.post('/admin/inventory/reconcile', headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert response.json() == {
+        'items_checked': 4, 'drifted': [], 'unknown_item_ids': []}
+
+    # Lost PO write: inventory claims items no PO accounts for
+    item_inventory._sub_quantity('item2', 'available', 5)
+    item_inventory._add_quantity('item2', 'purchased', 5)
+    # Lost inventory move: PO exists without inventory
+    item_inventory._sub_quantity('item1', 'purchased', 3)
+    item_inventory._add_quantity('item1', 'available', 3)
+
+
+def test_reconcile_and_fix_drift():
+    """Drift is reported, fixed, and gone afterwards
+    """
+    _create_drift()
+    response = client.post('/admin/inventory/reconcile', headers=ADMIN_HEADERS)
+    assert response.json()['drifted'] == [
+        {'item_id': 'item1', 'purchased': -3, 'received': 0,
+         'delivered': 0, 'fixed': False},
+        {'item_id': 'item2', 'purchased': 5, 'received': 0,
+         'delivered': 0, 'fixed': False},
+    ]
+
+    response = client.post('/admin/inventory/reconcile?fix=true',
+                           headers=ADMIN_HEADERS)
+    assert [item['fixed'] for item in response.json()['drifted']] == [True, True]
+    assert item_inventory.check_item('item1')['available'] == 95
+    assert item_inventory.check_item('item1')['purchased'] == 5
+    assert item_inventory.check_item('item2')['available'] == 95
+    assert item_inventory.check_item('item2')['purchased'] == 5
+
+    response = client.post('/admin/inventory/reconcile', headers=ADMIN_HEADERS)
+    assert response.json()['drifted'] == []
+
+
+def test_fix_failing_after_concurrent_move(monkeypatch):
+    """An item a concurrent move left without enough to fix is reported
+    as not fixed and left alone, and the other items are still fixed
+    """
+    _create_drift()
+    dump_counters = item_inventory._dump_counters
+
+    def dump_counters_then_move(copied):
+        # Runs while reconciling, after the counters were copied
+        item_inventory._sub_quantity('item1', 'available', 97)
+        item_inventory._add_quantity('item1', 'purchased', 97)
+        return dump_counters(copied)
+    monkeypatch.setattr(item_inventory, '_dump_counters', dump_counters_then_move)
+
+    response = client.post('/admin/inventory/reconcile?fix=true',
+                           headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert [(item['item_id'], item['fixed']) for item in response.json()['drifted']] == [
+        ('item1', False), ('item2', True)]
+    assert item_inventory.check_item('item1')['available'] == 1
+    assert item_inventory.check_item('item1')['purchased'] == 99
+    assert item_inventory.check_item('item2')['available'] == 95
+    assert item_inventory.check_item('item2')['purchased'] == 5
+
+
+PURCHASE_ORDER = schemas.PurchaseOrderCreate(
+    seller_id='seller123',
+    buyer_id='buyer123',
+    item_id='item1',
+    item_quantity=3,
+    price_usd=350.5,
+)
+
+
+def _item1_drift(reconciliation: schemas.InventoryReconciliation):
+    return [(item.purchased, item.fixed) for item in reconciliation.drifted
+            if item.item_id == 'item1']
+
+
+def test_moves_in_progress_are_not_fixed():
+    """A PO committed, but not moved to 'purchased' yet, looks like
+    drift. It is reported, but fixing it would count the move twice.
+    """
+    with SessionLocal() as db:
+        with item_inventory.transact_item_storage('item1', 'available', 'purchased', 3):
+            crud.create_purchase_order(db, PURCHASE_ORDER)
+            reconciliation = reconcile_inventory(db, item_inventory, fix=True)
+            assert _item1_drift(reconciliation) == [(-3, False)]
+        assert item_inventory.check_item('item1')['available'] == 97
+        assert item_inventory.check_item('item1')['purchased'] == 3
+        assert reconcile_inventory(db, item_inventory).drifted == []
+
+
+def test_moves_during_reconcile_are_not_fixed(monkeypatch):
+    """A whole move made after reading the POs looks like drift too
+    """
+    with SessionLocal() as db:
+        dump_counters = item_inventory._dump_counters
+
+        def move_then_dump_counters(_copied):
+            with item_inventory.transact_item_storage('item1', 'available', 'purchased', 3):
+                crud.create_purchase_order(db, PURCHASE_ORDER)
+            with item_inventory.lock:
+                return dump_counters(item_inventory._copy_counters())
+        monkeypatch.setattr(item_inventory, '_dump_counters', move_then_dump_counters)
+
+        reconciliation = reconcile_inventory(db, item_inventory, fix=True)
+        assert _item1_drift(reconciliation) == [(3, False)]
+        monkeypatch.undo()
+        assert item_inventory.check_item('item1')['available'] == 97
+        assert item_inventory.check_item('item1')['purchased'] == 3
+        assert reconcile_inventory(db, item_inventory).drifted == []
@@ -0,0 +1,200 @@
+"""Tests on request coalescing
+"""
+import threading
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from .main import app, read_flight
+from .singleflight import SharedCallError, SingleFlight, SingleFlightTimeout
+
+client = TestClient(app)
+
+
+def _run_concurrently(flight: SingleFlight, key, function, n_threads: int):
+    results = [None] * n_threads
+    errors = [None] * n_threads
+
+    def run(index):
+        try:
+            results[index] = flight.do(key, function)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            errors[index] = error
+
+    threads = [threading.Thread(target=run, args=(index,))
+               for index in range(n_threads)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_calls_are_coalesced():
+    """Calls with the same key while one is in flight share its result
+    """
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        release.wait()
+        return b'result'
+
+    threads, results, _ = _run_concurrently(flight, 'key', slow, 5)
+    while flight.calls < 5:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results == [b'result'] * 5
+    assert flight.stats()['coalescing_ratio'] == 0.8
+    assert flight.stats()['keys_in_flight'] == 0
+    assert flight.do('key', lambda: b'again') == b'again'
+
+
+def test_errors_are_shared():
+    """Waiting calls raise from the exception of the call they waited on
+    """
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait()
+        raise ValueError('failed')
+
+    threads, _, errors = _run_concurrently(flight, 'key', failing, 3)
+    while flight.calls < 3:
+        time.sleep(0.001)
+    release.set()
+    for thread in threads:
+        thread.join()
+    leader_errors = [error for error in errors if isinstance(error, ValueError)]
+    assert len(leader_errors) == 1
+    shared_errors = [error for error in errors if isinstance(error, SharedCallError)]
+    assert len(shared_errors) == 2
+    assert all(error.__cause__ is leader_errors[0] for error in shared_errors)
+
+
+def test_timeout_and_bounded_keys():
+    """Waiting calls give up after the timeout without running
+    function, and keys are bounded
+    """
+    flight = SingleFlight(max_keys=1, timeout=0.01)
+    release = threading.Event()
+    threads, _, _ = _run_concurrently(flight, 'key', release.wait, 1)
+    while flight.stats()['keys_in_flight'] < 1:
+        time.sleep(0.001)
+    try:
+        with pytest.raises(SingleFlightTimeout):
+            flight.do('key', lambda: pytest.fail('ran while the leader was running'))
+        assert flight.do('other', lambda: 'bypassed') == 'bypassed'
+    finally:
+        release.set()
+        threads[0].join()
+    assert flight.timeouts == 1
+    assert flight.bypassed == 1
+
+
+def test_forget():
+    """Calls after forgetting a key don't join its flight
+    """
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def stale():
+        release.wait()
+        return 'stale'
+
+    threads, results, _ = _run_concurrently(flight, 'key', stale, 1)
+    while flight.stats()['keys_in_flight'] < 1:
+        time.sleep(0.001)
+    flight.forget(lambda key: key == 'other')
+    assert flight.stats()['keys_in_flight'] == 1
+    flight.forget(lambda key: key == 'key')
+    assert flight.do('key', lambda: 'fresh') == 'fresh'
+
+    new_release = threading.Event()
+    new_threads, new_results, _ = _run_concurrently(
+        flight, 'key', lambda: new_release.wait() and 'newer', 1)
+    while flight.stats()['keys_in_flight'] < 1:
+        time.sleep(0.001)
+    # The forgotten call finishing leaves the newer one in flight
+    release.set()
+    threads[0].join()
+    assert results == ['stale']
+    assert flight.stats()['keys_in_flight'] == 1
+    new_release.set()
+    new_threads[0].join()
+    assert new_results == ['newer']
+    assert flight.stats()['keys_in_flight'] == 0
+
+
+def _create_purchase_order():
+    response = client.post('/purchase_orders', json={
+        'seller_id': 'seller123',
+        'buyer_id': 'buyer123',
+        'item_id': 'item1',
+        'item_quantity': 3,
+        'price_usd': 350.5,
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+def test_reads_after_writes_see_them():
+    """A read sent after a write doesn't join a read from before it
+    """
+    purchase_order = _create_purchase_order()
+    release = threading.Event()
+
+    def stale_read():
+        release.wait()
+        return b'{"status": "PURCHASED"}'
+
+    threads, _, _ = _run_concurrently(
+        read_flight, ('purchase_order', purchase_order['id']), stale_read, 1)
+    while read_flight.stats()['keys_in_flight'] < 1:
+        time.sleep(0.001)
+    try:
+        assert client.post(
+            f'/purchase_orders/receive/{purchase_order["id"]}').status_code == 200
+        response = client.get(f'/purchase_orders/{purchase_order["id"]}')
+        assert response.json()['status'] == 'RECEIVED'
+    finally:
+        release.set()
+        threads[0].join()
+
+
+def test_read_timeout(monkeypatch):
+    """Reads that wait too long on a slow read get a 503
+    """
+    monkeypatch.setattr(read_flight, 'timeout', 0.01)
+    release = threading.Event()
+    threads, _, _ = _run_concurrently(
+        read_flight, ('purchase_order', 1), release.wait, 1)
+    while read_flight.stats()['keys_in_flight'] < 1:
+        time.sleep(0.001)
+    try:
+        response = client.get('/purchase_orders/1')
+        assert response.status_code == 503
+        assert response.headers['Retry-After'] == '1'
+    finally:
+        release.set()
+        threads[0].join()
+
+
+@pytest.mark.parametrize('path', ['/purchase_orders/', '/purchase_orders/1'])
+def test_read_routes_report_coalescing(path):
+    """Read routes go through single-flight, and it shows in metrics
+    """
+    _create_purchase_order()
+    before = client.get('/admin/metrics', headers={
+        'X-Admin-Token': 'test-admin-token'}).json()['singleflight']['calls']
+    assert client.get(path).status_code == 200
+    after = client.get('/admin/metrics', headers={
+        'X-Admin-Token': 'test-admin-token'}).json()['singleflight']
+    assert after['calls'] == before + 1
+    assert 'coalescing_ratio' in after
@@ -0,0 +1,111 @@
+"""PO Status Transitions
+
+A table-driven state machine for PO statuses. Each transition
+moves POs from one status to the next, and moves their items
+between the matching item inventory storage keys.
+
+Transitions are applied to a set of POs at once, with the same
+number of queries and inventory operations no matter how many
+POs there are: one query for the PO items, one aggregated
+inventory move, and one conditional UPDATE.
+"""
+from collections.abc import Collection
+from typing import NamedTuple
+
+from sqlalchemy.orm import Session
+
+from . import crud, models
+from .inventory import ExampleItemInventory
+from .models import PurchaseOrderStatus
+
+
+class Transition(NamedTuple):
+    """A PO status transition, and its item inventory move
+    """
+    action: str
+    source_status: PurchaseOrderStatus
+    source_storage_key: str
+    target_storage_key: str
+
+
+# Transitions, by status they move POs to
+TRANSITIONS: dict[PurchaseOrderStatus, Transition] = {
+    PurchaseOrderStatus.RECEIVED: Transition(
+        'receive', PurchaseOrderStatus.PURCHASED, 'purchased', 'received'),
+    PurchaseOrderStatus.DELIVERED: Transition(
+        'deliver', PurchaseOrderStatus.RECEIVED, 'received', 'delivered'),
+}
+
+
+class PurchaseOrderNotFound(Exception):
+    """PO not found
+
+    Should be raised if a PO to transition does not exist.
+    """
+
+
+class InvalidTransition(Exception):
+    """Invalid transition
+
+    Should be raised if a PO is not in the status
+    a transition moves POs from.
+    """
+
+
+def transition_purchase_orders(
+    db: Session,
+    item_inventory: ExampleItemInventory,
+    purchase_order_ids: Collection[int],
+    target_status: PurchaseOrderStatus,
+):
+    """Move POs to target_status, along with their inventory
+
+    All POs are moved, or none are.
+
+    Args:
+        db (Session): database
+        item_inventory (ExampleItemInventory): Item inventory
+        purchase_order_ids (Collection[int]): PO IDs
+        target_status (PurchaseOrderStatus): Status to move the POs to
+
+    Raises:
+        PurchaseOrderNotFound: If any PO does not exist
+        InvalidTransition: If any PO is not in the transition's source
+            status, or is archived
+
+    Returns:
+        list[models.PurchaseOrder]: Updated POs, ordered by ID
+    """
+    transition = TRANSITIONS[target_status]
+    purchase_order_ids = set(purchase_order_ids)
+
+    statuses: dict[int, models.PurchaseOrderStatus] = {}
+    quantities: dict[str, int] = {}
+    for purchase_order_id, status, item_id, item_quantity in \
+            crud.get_item_quantities(db, purchase_order_ids):
+        statuses[purchase_order_id] = status
+        quantities[item_id] = quantities.get(item_id, 0) + item_quantity
+
+    missing = purchase_order_ids - statuses.keys()
+    if missing and crud.get_archived_purchase_order_ids(db, missing):
+        raise InvalidTransition(
+            f'Can only {transition.action} a PO from '
+            f'{transition.source_status.lower()} status')
+    if missing:
+        raise PurchaseOrderNotFound(
+            f'Purchase Order not found: {", ".join(map(str, sorted(missing)))}')
+    if any(status != transition.source_status for status in statuses.values()):
+        raise InvalidTransition(
+            f'Can only {transition.action} a PO from '
+            f'{transition.source_status.lower()} status')
+
+    # Items are claimed from the source storage key before the
+    # update, and put back there if the update fails.
+    #
+    # See transact_item_storage for more details
+    with item_inventory.transact_items_storage(
+            quantities, transition.source_storage_key,
+            transition.target_storage_key):
+        crud.update_purchase_orders_status(
+            db, purchase_order_ids, transition.source_status, target_status)
+    return crud.get_purchase_orders_by_ids(db, purchase_order_ids)